@@ -0,0 +1,98 @@
+"""Кэш пользователь-независимой части рецепта.
+Тело рецепта (теги, автор, ингредиенты, описание) одинаково для всех
+пользователей и кэшируется по id рецепта и версии. Версия складывается
+из счетчика изменений самого рецепта, счетчиков таблиц тегов
+и ингредиентов и имени картинки, прочитанного вместе с рецептом: замену
+файлов другим процессом (фоновая обработка, dedupe_media) видят все
+воркеры; правка имени или почты автора сдвигает счетчики его
+рецептов, а регистрация и вход других пользователей тела не трогают.
+Флаги избранного, корзины и подписки
+накладываются поверх из трех множеств, посчитанных на весь запрос.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import versions
+from recipes.models import FavoriteRecipe, ShoppingCart, Subscribe
+
+KEY = 'recipe_fragment:{origin}:{recipe_id}:{version}'
+TABLE = 'recipe'
+SHARED_TABLES = ('tag', 'ingredient')
+
+
+def get_table(recipe_id):
+    return versions.get_row_table(TABLE, recipe_id)
+
+
+def bump_recipe_versions(recipe_ids):
+    versions.bump_row_versions(TABLE, recipe_ids)
+
+
+def get_image_stamp(recipe):
+    return hashlib.sha1((recipe.image.name or '').encode()).hexdigest()[:8]
+
+
+def get_fragments(recipes, request, render):
+    """Возвращает тела рецептов {id: данные}. У recipes должны быть
+    загружены id и image. Отсутствующие в кэше строятся одним вызовом
+    render(ids) и сохраняются.
+    """
+    recipes = list({recipe.id: recipe for recipe in recipes}.values())
+    recipe_ids = [recipe.id for recipe in recipes]
+    stamps = versions.get_versions(
+        [*SHARED_TABLES, *map(get_table, recipe_ids)])
+    shared = '.'.join(map(str, stamps[:len(SHARED_TABLES)]))
+    origin = request.get_host() if request else ''
+    keys = {
+        recipe.id: KEY.format(
+            origin=origin, recipe_id=recipe.id,
+            version=f'{stamp}.{shared}.{get_image_stamp(recipe)}')
+        for recipe, stamp in zip(recipes, stamps[len(SHARED_TABLES):])}
+    cached = cache.get_many(keys.values())
+    fragments = {
+        recipe_id: cached[key]
+        for recipe_id, key in keys.items() if key in cached}
+    missing = [
+        recipe_id for recipe_id in recipe_ids if recipe_id not in fragments]
+    if missing:
+        rendered = render(missing)
+        cache.set_many(
+            {keys[recipe_id]: body for recipe_id, body in rendered.items()},
+            settings.RECIPE_FRAGMENT_TIMEOUT)
+        fragments.update(rendered)
+    return fragments
+
+
+def get_user_flags(user, recipe_ids, author_ids):
+    """Множества id: рецепты в избранном, рецепты в корзине и авторы,
+    на которых подписан пользователь.
+    """
+    if not user.is_authenticated:
+        return set(), set(), set()
+    favorites = FavoriteRecipe.recipe.through.objects.filter(
+        favoriterecipe__user=user, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True)
+    cart = ShoppingCart.recipe.through.objects.filter(
+        shoppingcart__user=user, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True)
+    subscriptions = Subscribe.objects.filter(
+        user=user, author_id__in=author_ids
+    ).values_list('author_id', flat=True)
+    return set(favorites), set(cart), set(subscriptions)
+
+
+def overlay(body, favorites, cart, subscriptions):
+    """Добавляет к телу рецепта флаги пользователя в порядке полей
+    RecipeReadSerializer.
+    """
+    data = {}
+    for key, value in body.items():
+        if key == 'author':
+            value = {**value, 'is_subscribed': value['id'] in subscriptions}
+        data[key] = value
+        if key == 'ingredients':
+            data['is_favorited'] = body['id'] in favorites
+            data['is_in_shopping_cart'] = body['id'] in cart
+    return data
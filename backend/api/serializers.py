@@ -1,19 +1,86 @@
+from collections import Counter
+
 import django.contrib.auth.password_validation as validators
+from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.hashers import make_password
-from django.shortcuts import get_object_or_404
-from drf_base64.fields import Base64ImageField
+from django.db import models, transaction
+from django.utils.encoding import filepath_to_uri
+from recipes import images, search, shopping_totals
+from recipes.catalog import ingredient_catalog
 from recipes.models import (Ingredient, Recipe,
                             RecipeIngredient, Subscribe, Tag)
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from core import versions
+from core.db.router import read_from_primary
 from core.validators import validate_min
+from . import fragments
 User = get_user_model()
 ERROR_MESSAGE = 'Не удается войти в систему с текущими данными'
 from core.mixins import GetIsSubscribedMixin
 
 
 
+class ImagePayloadField(serializers.Field):
+    """Картинка в base64. Возвращает байты после проверки заголовка,
+    остальная обработка идет в recipes.images.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['write_only'] = True
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            raise serializers.ValidationError(
+                'Ожидается строка base64.')
+        try:
+            return images.decode(data)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+
+
+def get_media_prefix(context):
+    """Абсолютный MEDIA_URL, считается один раз на сериализацию."""
+    prefix = context.get('media_prefix')
+    if prefix is None:
+        request = context.get('request')
+        prefix = (
+            request.build_absolute_uri(settings.MEDIA_URL)
+            if request else settings.MEDIA_URL)
+        context['media_prefix'] = prefix
+    return prefix
+
+
+class MediaURLField(serializers.Field):
+    """Ссылка на файл: MEDIA_URL и сохраненное имя, без обращений
+    к хранилищу."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return get_media_prefix(self.context) + filepath_to_uri(value.name)
+
+
+class ThumbnailsField(serializers.Field):
+    """Ссылки на миниатюры {ширина: url}."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        prefix = get_media_prefix(self.context)
+        return {
+            width: prefix + filepath_to_uri(name)
+            for width, name in value.items()}
+
+
 class TokenSerializer(serializers.Serializer):
     """Сериализует данные для получения токена."""
 
@@ -50,15 +117,6 @@ class TokenSerializer(serializers.Serializer):
         return attrs
 
 
-class GetIsSubscribedMixin:
-
-    def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if not user.is_authenticated:
-            return False
-        return user.follower.filter(author=obj).exists()
-
-
 class UserListSerializer(GetIsSubscribedMixin, serializers.ModelSerializer):
     """Сериализатор данные для пользователей."""
 
@@ -153,22 +211,6 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeUserSerializer(
-        GetIsSubscribedMixin,
-        serializers.ModelSerializer):
-    """Сериализует данные рецепта."""
-
-    is_subscribed = serializers.SerializerMethodField(
-        read_only=True)
-
-    class Meta:
-        model = User
-        fields = (
-            'email', 'id', 'username',
-            'first_name', 'last_name', 'is_subscribed')
-
-
-
 class IngredientsEditSerializer(serializers.ModelSerializer):
     """Серилизатор для ингредиентов."""
 
@@ -184,12 +226,9 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     """Сериализатор создания рецепта.
     Валидирует данные и возвращает RecipeReadSerializer."""
 
-    image = Base64ImageField(
-        max_length=None,
-        use_url=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all())
+    image = ImagePayloadField()
+    tags = serializers.ListField(
+        child=serializers.IntegerField())
     ingredients = IngredientsEditSerializer(
         many=True)
 
@@ -199,23 +238,32 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         read_only_fields = ('author',)
 
     def validate(self, data):
-        ingredients = data['ingredients']
-        ingredient_list = []
-        for items in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient, id=items['id'])
-            if ingredient in ingredient_list:
+        if 'ingredients' in data:
+            ids = [items['id'] for items in data['ingredients']]
+            duplicates = sorted(
+                pk for pk, count in Counter(ids).items() if count > 1)
+            if duplicates:
                 raise serializers.ValidationError(
-                    'Ингредиент уже существует.')
-            ingredient_list.append(ingredient)
-        tags = data['tags']
-        if not tags:
-            raise serializers.ValidationError(
-                'Необходимо добавить тег.')
-        for tag_name in tags:
-            if not Tag.objects.filter(name=tag_name).exists():
+                    f'Ингредиенты повторяются: id={duplicates}.')
+            found = ingredient_catalog.get_many(ids)
+            missing = [pk for pk in ids if pk not in found]
+            if missing:
+                raise serializers.ValidationError(
+                    f'Ингредиентов не существует: id={missing}.')
+        if 'tags' in data:
+            ids = data['tags']
+            if not ids:
+                raise serializers.ValidationError(
+                    'Необходимо добавить тег.')
+            if len(set(ids)) != len(ids):
+                raise serializers.ValidationError(
+                    'Теги повторяются.')
+            tags = Tag.objects.in_bulk(ids)
+            missing = [pk for pk in ids if pk not in tags]
+            if missing:
                 raise serializers.ValidationError(
-                    f'Тега не существует.')
+                    f'Тегов не существует: id={missing}.')
+            data['tags'] = [tags[pk] for pk in ids]
         return data
 
     def validate_cooking_time(self, cooking_time):
@@ -248,60 +296,182 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             for ingredient in ingredients]
         )
 
+    def update_ingredients(self, ingredients, recipe):
+        """Сравнивает новый состав с текущим и меняет только
+        отличающиеся строки. Возвращает изменения количеств
+        {ingredient_id: разница} для списков покупок."""
+        existing = {
+            row.ingredient_id: row
+            for row in RecipeIngredient.objects.filter(recipe=recipe)}
+        submitted = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients}
+        to_create, to_update, deltas = [], [], {}
+        for ingredient_id, amount in submitted.items():
+            row = existing.get(ingredient_id)
+            if row is None:
+                to_create.append(RecipeIngredient(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=amount))
+                deltas[ingredient_id] = amount
+            elif row.amount != amount:
+                deltas[ingredient_id] = amount - row.amount
+                row.amount = amount
+                to_update.append(row)
+        to_delete = []
+        for ingredient_id, row in existing.items():
+            if ingredient_id not in submitted:
+                to_delete.append(row.id)
+                deltas[ingredient_id] = -row.amount
+        RecipeIngredient.objects.filter(id__in=to_delete).delete()
+        RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        RecipeIngredient.objects.bulk_create(to_create)
+        return deltas
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        image = validated_data.pop('image')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(ingredients, recipe)
+        images.attach(recipe, image)
+        fragments.bump_recipe_versions([recipe.id])
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients, instance)
+            deltas = self.update_ingredients(
+                validated_data.pop('ingredients'), instance)
+            shopping_totals.apply_deltas(
+                shopping_totals.get_cart_user_ids(instance), deltas)
+            search.schedule_update([instance.id])
         if 'tags' in validated_data:
             instance.tags.set(
                 validated_data.pop('tags'))
-        return super().update(
-            instance, validated_data)
+        if 'image' in validated_data:
+            images.attach(instance, validated_data.pop('image'))
+        # Только переданные поля: счетчики меняют сигналы, картинку
+        # с миниатюрами - images.attach и фоновая обработка.
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if validated_data:
+            instance.save(update_fields=list(validated_data))
+        versions.bump_version('recipe')
+        fragments.bump_recipe_versions([instance.id])
+        return instance
 
     def to_representation(self, instance):
         context = {'request': self.context.get('request')}
         return RecipeReadSerializer(instance, context=context).data
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
-    """Сериализатор для отображения информации о рецепте."""
+class RecipeAuthorSerializer(serializers.ModelSerializer):
+    """Автор рецепта без флага подписки: он добавляется отдельно."""
+
+    class Meta:
+        model = User
+        fields = (
+            'email', 'id', 'username',
+            'first_name', 'last_name')
+
+
+class RecipeBodySerializer(serializers.ModelSerializer):
+    """Часть рецепта, одинаковая для всех пользователей."""
 
-    image = Base64ImageField()
+    image = MediaURLField()
+    thumbnails = ThumbnailsField()
     tags = TagSerializer(
         many=True,
         read_only=True)
-    author = RecipeUserSerializer(
-        read_only=True,
-        default=serializers.CurrentUserDefault())
+    author = RecipeAuthorSerializer(
+        read_only=True)
     ingredients = RecipeIngredientSerializer(
         many=True,
         required=True,
         source='recipe')
-    is_favorited = serializers.BooleanField(
-        read_only=True)
-    is_in_shopping_cart = serializers.BooleanField(
-        read_only=True)
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        fields = (
+            'id', 'image', 'image_width', 'image_height', 'thumbnails',
+            'tags', 'author', 'ingredients',
+            'pub_date', 'name', 'text', 'cooking_time',
+            'favorites_count', 'in_carts_count')
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, models.Manager) else data
+        return self.child.represent(list(recipes))
+
+
+class RecipeReadSerializer(serializers.BaseSerializer):
+    """Сериализатор для отображения информации о рецепте.
+    Тело берется из кэша фрагментов, флаги пользователя накладываются
+    из трех множеств, посчитанных на весь список.
+    """
+
+    class Meta:
+        list_serializer_class = RecipeListSerializer
+
+    def render_bodies(self, recipe_ids):
+        """Тела строятся из основной БД: счетчик рецепта уже сдвинут,
+        и тело с отстающей реплики закэшировалось бы под новой версией.
+        """
+        serializer = RecipeBodySerializer(context=self.context)
+        with read_from_primary():
+            recipes = Recipe.objects.select_related(
+                'author').prefetch_for_read().filter(id__in=recipe_ids)
+            return {
+                recipe.id: serializer.to_representation(recipe)
+                for recipe in recipes}
+
+    def represent(self, recipes):
+        request = self.context.get('request')
+        recipe_ids = [recipe.id for recipe in recipes]
+        bodies = fragments.get_fragments(
+            recipes, request, self.render_bodies)
+        flags = fragments.get_user_flags(
+            request.user, recipe_ids,
+            {recipe.author_id for recipe in recipes})
+        return [
+            fragments.overlay(bodies[recipe_id], *flags)
+            for recipe_id in recipe_ids]
+
+    def to_representation(self, instance):
+        return self.represent([instance])[0]
 
 
 class SubscribeRecipeSerializer(serializers.ModelSerializer):
     """Сериализует данные для добавления рецепта в избранное."""
 
+    image = MediaURLField()
+    thumbnails = ThumbnailsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = (
+            'id', 'name', 'image', 'image_width', 'image_height',
+            'thumbnails', 'cooking_time')
+
+
+def get_recipes_limit(request):
+    """Число рецептов автора в подписках: ?recipes_limit= не больше
+    SUBSCRIPTION_RECIPES_MAX_LIMIT, без параметра или при неверном
+    значении SUBSCRIPTION_RECIPES_LIMIT.
+    """
+    try:
+        limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return settings.SUBSCRIPTION_RECIPES_LIMIT
+    if limit < 1:
+        return settings.SUBSCRIPTION_RECIPES_LIMIT
+    return min(limit, settings.SUBSCRIPTION_RECIPES_MAX_LIMIT)
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -343,11 +513,10 @@ class SubscribeSerializer(serializers.ModelSerializer):
         )
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = (
-            obj.author.recipe.all()[:int(limit)] if limit
-            else obj.author.recipe.all())
+        recipes = getattr(obj.author, 'top_recipes', None)
+        if recipes is None:
+            limit = get_recipes_limit(self.context.get('request'))
+            recipes = obj.author.recipe.order_by('-pub_date', '-id')[:limit]
         return SubscribeRecipeSerializer(
             recipes,
             many=True).data
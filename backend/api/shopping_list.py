@@ -0,0 +1,158 @@
+"""Формирование списка покупок.
+Сводные количества хранятся в ShoppingCartIngredient и обновляются
+при изменении корзины (recipes.shopping_totals), поэтому выгрузка
+читает одну таблицу.
+Готовый PDF кэшируется для пользователя по хэшу содержимого корзины,
+большие списки рендерятся в фоновом пуле потоков.
+"""
+import csv
+import hashlib
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from recipes.models import ShoppingCartIngredient
+
+FONT = 'Vera'
+CACHE_KEY = 'shopping_cart_pdf:{user_id}'
+PENDING_KEY = 'shopping_cart_pdf_pending:{user_id}:{digest}'
+CHUNK_SIZE = 500
+CSV_HEADER = ('Название', 'Единицы измерения', 'Количество')
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.SHOPPING_CART_RENDER_WORKERS)
+
+
+def register_fonts():
+    """Регистрирует шрифт один раз при старте приложения."""
+    pdfmetrics.registerFont(TTFont(FONT, 'Vera.ttf'))
+
+
+def get_shopping_list_queryset(user):
+    """Сводный список ингредиентов из рецептов в корзине."""
+    return ShoppingCartIngredient.objects.filter(user=user).values(
+        'amount',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+    ).order_by('name', 'measurement_unit')
+
+
+def get_shopping_list(user):
+    return list(get_shopping_list_queryset(user))
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def stream_txt(user):
+    """Построчно отдает список покупок по мере чтения курсора."""
+    yield 'Cписок покупок:\n'
+    items = get_shopping_list_queryset(user).iterator(chunk_size=CHUNK_SIZE)
+    for index, item in enumerate(items, start=1):
+        yield (
+            f'{index}. {item["name"]} - '
+            f'{item["amount"]} '
+            f'{item["measurement_unit"]}.\n')
+
+
+def stream_csv(user):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    items = get_shopping_list_queryset(user).iterator(chunk_size=CHUNK_SIZE)
+    for item in items:
+        yield writer.writerow((
+            item['name'],
+            item['measurement_unit'],
+            item['amount']))
+
+
+def get_digest(shopping_list):
+    return hashlib.sha256(
+        json.dumps(shopping_list, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+def render_pdf(shopping_list):
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer)
+    x_position, y_position = 50, 800
+    page.setFont(FONT, 14)
+    if shopping_list:
+        indent = 20
+        page.drawString(x_position, y_position, 'Cписок покупок:')
+        for index, recipe in enumerate(shopping_list, start=1):
+            page.drawString(
+                x_position, y_position - indent,
+                f'{index}. {recipe["name"]} - '
+                f'{recipe["amount"]} '
+                f'{recipe["measurement_unit"]}.')
+            y_position -= 15
+            if y_position <= 50:
+                page.showPage()
+                page.setFont(FONT, 14)
+                y_position = 800
+    else:
+        page.setFont(FONT, 24)
+        page.drawString(
+            x_position,
+            y_position,
+            'Ваш список покупок пуст.')
+    page.save()
+    return buffer.getvalue()
+
+
+def get_cached_pdf(user_id, digest):
+    cached = cache.get(CACHE_KEY.format(user_id=user_id))
+    if cached and cached['digest'] == digest:
+        return cached['pdf']
+    return None
+
+
+def render_and_cache(user_id, digest, shopping_list):
+    pdf = render_pdf(shopping_list)
+    cache.set(
+        CACHE_KEY.format(user_id=user_id),
+        {'digest': digest, 'pdf': pdf},
+        settings.SHOPPING_CART_CACHE_TIMEOUT)
+    return pdf
+
+
+def render_in_background(user_id, digest, shopping_list):
+    """Ставит рендер в фоновый пул, если он еще не запущен.
+    Флаг задачи хранится в кэше, чтобы воркеры не дублировали работу.
+    Флаг живет SHOPPING_CART_RENDER_TIMEOUT секунд: если процесс
+    с рендером упадет, следующий запрос после этого срока запустит
+    рендер заново.
+    """
+    pending_key = PENDING_KEY.format(user_id=user_id, digest=digest)
+    if not cache.add(
+            pending_key, True, settings.SHOPPING_CART_RENDER_TIMEOUT):
+        return None
+
+    def render():
+        try:
+            return render_and_cache(user_id, digest, shopping_list)
+        finally:
+            cache.delete(pending_key)
+
+    try:
+        return executor.submit(render)
+    except RuntimeError:
+        cache.delete(pending_key)
+        raise
+
+
+def invalidate(user_ids):
+    cache.delete_many(
+        [CACHE_KEY.format(user_id=user_id) for user_id in user_ids])
@@ -0,0 +1,243 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core import versions
+from core.authentication import invalidate_user_tokens, token_cache
+from recipes import blobs, catalog, counters, search, shopping_totals
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart,
+                            ShoppingCartIngredient, Subscribe, Tag)
+from . import fragments, shopping_list
+
+User = get_user_model()
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver(m2m_changed, sender=ShoppingCart.recipe.through)
+def update_shopping_list_totals(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """Поддерживает сводные количества при изменении корзины.
+    Вычитание выполняется до удаления, пока известно, какие рецепты
+    действительно лежали в корзине.
+    """
+    if not reverse:
+        user_ids = [instance.user_id]
+        if action == 'post_add':
+            shopping_totals.change_totals(user_ids, pk_set, 1)
+        elif action == 'pre_remove':
+            shopping_totals.change_totals(
+                user_ids,
+                instance.recipe.filter(
+                    id__in=pk_set).values_list('id', flat=True),
+                -1)
+        elif action == 'pre_clear':
+            ShoppingCartIngredient.objects.filter(
+                user_id=instance.user_id).delete()
+        return
+    carts = ShoppingCart.objects.all()
+    if action == 'post_add':
+        shopping_totals.change_totals(
+            carts.filter(id__in=pk_set).values_list('user_id', flat=True),
+            [instance.id], 1)
+    elif action in ('pre_remove', 'pre_clear'):
+        if action == 'pre_remove':
+            carts = carts.filter(id__in=pk_set)
+        shopping_totals.change_totals(
+            carts.filter(recipe=instance).values_list('user_id', flat=True),
+            [instance.id], -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    shopping_totals.change_totals(
+        shopping_totals.get_cart_user_ids(instance), [instance.id], -1)
+
+
+@receiver(m2m_changed, sender=ShoppingCart.recipe.through)
+def invalidate_shopping_list(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    """Сбрасывает кэш PDF при изменении состава корзины."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.user_id]
+    elif pk_set:
+        user_ids = ShoppingCart.objects.filter(
+            id__in=pk_set).values_list('user_id', flat=True)
+    else:
+        return
+    shopping_list.invalidate(user_ids)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Выход из системы сразу закрывает доступ по токену."""
+    token_cache.delete([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_token_cache(sender, instance, created, **kwargs):
+    """Смена пароля, блокировка и правка профиля обновляют снимок
+    пользователя в кэше токенов."""
+    if not created:
+        invalidate_user_tokens(instance.id)
+
+
+@receiver(m2m_changed, sender=FavoriteRecipe.recipe.through)
+@receiver(m2m_changed, sender=ShoppingCart.recipe.through)
+def update_recipe_counters(sender, instance, action, reverse, model, pk_set,
+                           **kwargs):
+    """Меняет favorites_count/in_carts_count на число реально
+    добавленных или удаленных связей. Удаление учитывается до него,
+    пока известно, какие связи существовали.
+    """
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    owner = (model if reverse else instance)._meta.model_name
+    if reverse:
+        links = sender.objects.filter(recipe=instance)
+        lookup = f'{owner}__in'
+    else:
+        links = sender.objects.filter(**{owner: instance})
+        lookup = 'recipe__in'
+    if action != 'pre_clear':
+        links = links.filter(**{lookup: pk_set})
+    field = counters.COUNTERS[sender]
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        counters.change_counter(field, [instance.id], delta * links.count())
+    else:
+        counters.change_counter(
+            field, links.values_list('recipe_id', flat=True), delta)
+
+
+@receiver(pre_delete, sender=FavoriteRecipe)
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_recipe_counters(sender, instance, **kwargs):
+    """Удаление пользователя удаляет его избранное и корзину каскадом,
+    без m2m_changed."""
+    counters.change_counter(
+        counters.COUNTERS[sender.recipe.through],
+        instance.recipe.values_list('id', flat=True), -1)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredient_catalog(sender, **kwargs):
+    catalog.bump_version()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tag_catalog(sender, **kwargs):
+    catalog.bump_tag_version()
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_images(sender, instance, **kwargs):
+    """Удаляет файлы картинки, если на них не ссылаются другие рецепты."""
+    blobs.release(blobs.get_names(instance))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_index(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        search.schedule_update([instance.id])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def update_ingredients_search_index(sender, instance, **kwargs):
+    """Строки состава меняются пачкой: рецепт переиндексируется один
+    раз после коммита."""
+    search.schedule_update([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def update_renamed_ingredient_search_index(sender, instance, created,
+                                           **kwargs):
+    """Переиндексирует рецепты с переименованным ингредиентом."""
+    if not created:
+        search.update_search_index(
+            RecipeIngredient.objects.filter(
+                ingredient=instance).values('recipe'))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_search_index(sender, instance, **kwargs):
+    search.remove_from_search_index([instance.id])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def invalidate_recipe_fragment(sender, instance, **kwargs):
+    """Сбрасывает закэшированное тело рецепта."""
+    recipe_id = instance.id if sender is Recipe else instance.recipe_id
+    fragments.bump_recipe_versions([recipe_id])
+
+
+@receiver(pre_save, sender=User)
+def invalidate_author_recipe_fragments(sender, instance, update_fields,
+                                       **kwargs):
+    """Сбрасывает тела рецептов автора, если изменились выводимые
+    в них поля. Регистрация, вход и смена пароля рецепты не трогают.
+    """
+    if instance.pk is None or (
+            update_fields is not None
+            and not set(AUTHOR_FIELDS) & set(update_fields)):
+        return
+    saved = User.objects.filter(pk=instance.pk).values(*AUTHOR_FIELDS)
+    if not saved or all(
+            saved[0][field] == getattr(instance, field)
+            for field in AUTHOR_FIELDS):
+        return
+    recipe_ids = list(instance.recipe.values_list('id', flat=True))
+    if recipe_ids:
+        fragments.bump_recipe_versions(recipe_ids)
+        transaction.on_commit(lambda: versions.bump_version('recipe'))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_tagged_recipe_fragments(sender, instance, action, reverse,
+                                       pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post'):
+            fragments.bump_recipe_versions([instance.id])
+    elif action == 'pre_clear':
+        fragments.bump_recipe_versions(
+            instance.recipes.values_list('id', flat=True))
+    elif action.startswith('post') and pk_set:
+        fragments.bump_recipe_versions(pk_set)
+
+
+VERSIONED_MODELS = {
+    Tag: 'tag',
+    Ingredient: 'ingredient',
+    Recipe: 'recipe',
+    RecipeIngredient: 'recipe',
+    Recipe.tags.through: 'recipe',
+    User: 'user',
+    Subscribe: 'subscribe',
+    FavoriteRecipe.recipe.through: 'favorite',
+    ShoppingCart.recipe.through: 'shopping_cart',
+}
+
+
+def bump_table_version(sender, **kwargs):
+    """Меняет счетчик изменений таблицы: сбрасывает ETag и кэши
+    ответов."""
+    if kwargs.get('action', 'post').startswith('post'):
+        versions.bump_version(VERSIONED_MODELS[sender])
+
+
+for model in VERSIONED_MODELS:
+    for signal in (post_save, post_delete, m2m_changed):
+        signal.connect(
+            bump_table_version, sender=model,
+            dispatch_uid=f'bump_table_version_{model._meta.label}')
@@ -3,7 +3,8 @@ from rest_framework.routers import DefaultRouter
 
 from api.views import (SubscribeViewSet, FavoriteRecipeViewSet,
                        ShoppingCartViewSet, AuthToken, IngredientsViewSet,
-                       RecipesViewSet, TagsViewSet, UsersViewSet, set_password)
+                       RecipesViewSet, TagsViewSet, UsersViewSet,
+                       db_pool_stats, set_password)
 
 app_name = 'api'
 
@@ -23,6 +24,10 @@ urlpatterns = [
           'users/set_password/',
           set_password,
           name='set_password'),
+     path(
+          'metrics/db_pool/',
+          db_pool_stats,
+          name='db_pool_stats'),
      path(
           'users/<int:user_id>/subscribe/',
           SubscribeViewSet.as_view(),
@@ -1,36 +1,52 @@
 import io
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
-from django.db.models.aggregates import Count, Sum
 from django.db.models.expressions import Exists, OuterRef, Value
-from django.http import FileResponse
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
 from rest_framework import generics, status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.decorators import action, api_view
-from rest_framework.permissions import (SAFE_METHODS, AllowAny,
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import (SAFE_METHODS, AllowAny, IsAdminUser,
                                         IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from core.db import pool
 from core.filters import IngredientFilter, RecipeFilter
+from core.mixins import ConditionalGetMixin, ResponseCacheMixin
 from core.permissions import IsAdminOrReadOnly
-from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
-                            Subscribe, Tag)
+from recipes import catalog
+from recipes.catalog import ingredient_catalog, tag_catalog
+from recipes.models import (Ingredient, Recipe, Tag,
+                            prefetch_subscription_recipes)
+from . import shopping_list
+from .renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
 from .serializers import (IngredientSerializer, RecipeReadSerializer,
                           RecipeWriteSerializer, SubscribeRecipeSerializer,
                           SubscribeSerializer, TagSerializer, TokenSerializer,
                           UserCreateSerializer, UserListSerializer,
-                          UserPasswordSerializer)
+                          UserPasswordSerializer, get_recipes_limit)
 
 User = get_user_model()
 DOCUMENT = 'shoppingcart.pdf'
+RETRY_AFTER = 2
+STREAM_FORMATS = {
+    'txt': (shopping_list.stream_txt, 'text/plain; charset=utf-8'),
+    'csv': (shopping_list.stream_csv, 'text/csv; charset=utf-8'),
+}
+
+
+def wants_async(request):
+    """Клиент готов получить 202 и повторить запрос позже."""
+    return (
+        request.query_params.get('async') == '1'
+        or 'respond-async' in request.headers.get('Prefer', ''))
 
 
 class GetObjectMixin:
@@ -63,13 +79,15 @@ class SubscribeViewSet(
     serializer_class = SubscribeSerializer
 
     def get_queryset(self):
-        return self.request.user.follower.select_related(
-            'following'
-        ).prefetch_related(
-            'following__recipe'
-        ).annotate(
-            recipes_count=Count('following__recipe'),
-            is_subscribed=Value(True), )
+        return self.request.user.follower.with_author_stats().order_by(
+            '-pub_date', '-id')
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            prefetch_subscription_recipes(
+                page, get_recipes_limit(self.request))
+        return page
 
     def get_object(self):
         user_id = self.kwargs['user_id']
@@ -88,7 +106,7 @@ class SubscribeViewSet(
                 {'errors': 'Вы уже подписаны.'},
                 status=status.HTTP_400_BAD_REQUEST)
         subs = request.user.follower.create(author=instance)
-        serializer = self.get_serializer(subs)
+        serializer = self.get_serializer(self.get_queryset().get(id=subs.id))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def perform_destroy(self, instance):
@@ -162,6 +180,13 @@ class UsersViewSet(UserViewSet):
     serializer_class = UserListSerializer
     permission_classes = (IsAuthenticated,)
 
+    @property
+    def cursor_ordering(self):
+        """Курсорная пагинация доступна только для подписок."""
+        if self.action == 'subscriptions':
+            return ('-pub_date', '-id')
+        return None
+
     def get_queryset(self):
         return User.objects.annotate(
             is_subscribed=Exists(
@@ -187,16 +212,20 @@ class UsersViewSet(UserViewSet):
     def subscriptions(self, request):
         """Получить на кого пользователь подписан."""
 
-        user = request.user
-        queryset = Subscribe.objects.filter(user=user)
-        pages = self.paginate_queryset(queryset)
+        queryset = request.user.follower.with_author_stats().order_by(
+            '-pub_date', '-id')
+        pages = prefetch_subscription_recipes(
+            self.paginate_queryset(queryset), get_recipes_limit(request))
         serializer = SubscribeSerializer(
             pages, many=True,
             context={'request': request})
         return self.get_paginated_response(serializer.data)
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(
+        ConditionalGetMixin,
+        ResponseCacheMixin,
+        viewsets.ModelViewSet):
     """Вьюсет для рецептов. Доступны:
     Получение списка рецептов;
     Созданние рецепта;
@@ -208,6 +237,14 @@ class RecipesViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     filterset_class = RecipeFilter
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    conditional_tables = (
+        'recipe', 'tag', 'ingredient',
+        'subscribe', 'favorite', 'shopping_cart')
+    conditional_actions = ('retrieve',)
+    conditional_per_user = True
+    response_cache_tables = (
+        'recipe', 'tag', 'ingredient', 'favorite', 'shopping_cart')
+    cursor_ordering = ('-pub_date', '-id')
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -215,23 +252,10 @@ class RecipesViewSet(viewsets.ModelViewSet):
         return RecipeWriteSerializer
 
     def get_queryset(self):
-        return Recipe.objects.annotate(
-            is_favorited=Exists(
-                FavoriteRecipe.objects.filter(
-                    user=self.request.user, recipe=OuterRef('id'))),
-            is_in_shopping_cart=Exists(
-                ShoppingCart.objects.filter(
-                    user=self.request.user,
-                    recipe=OuterRef('id')))
-        ).select_related('author').prefetch_related(
-            'tags', 'ingredients', 'recipe',
-            'shopping_cart', 'favorite_recipe'
-        ) if self.request.user.is_authenticated else Recipe.objects.annotate(
-            is_in_shopping_cart=Value(False),
-            is_favorited=Value(False),
-        ).select_related('author').prefetch_related(
-            'tags', 'ingredients', 'recipe',
-            'shopping_cart', 'favorite_recipe')
+        queryset = Recipe.objects.all()
+        if self.request.method in SAFE_METHODS:
+            return queryset.only('id', 'author', 'pub_date', 'image')
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -239,49 +263,50 @@ class RecipesViewSet(viewsets.ModelViewSet):
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=(IsAuthenticated,))
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(
+            JSONRenderer, PDFRenderer, PlainTextRenderer, CSVRenderer))
     def download_shopping_cart(self, request):
-        """ Функция для скачивания."""
-
-        buffer = io.BytesIO()
-        page = canvas.Canvas(buffer)
-        pdfmetrics.registerFont(TTFont('Vera', 'Vera.ttf'))
-        x_position, y_position = 50, 800
-        shopping_cart = (
-            request.user.shopping_cart.recipe.
-            values(
-                'ingredients__name',
-                'ingredients__measurement_unit'
-            ).annotate(amount=Sum('recipe__amount')).order_by())
-        page.setFont('Vera', 14)
-        if shopping_cart:
-            indent = 20
-            page.drawString(x_position, y_position, 'Cписок покупок:')
-            for index, recipe in enumerate(shopping_cart, start=1):
-                page.drawString(
-                    x_position, y_position - indent,
-                    f'{index}. {recipe["ingredients__name"]} - '
-                    f'{recipe["amount"]} '
-                    f'{recipe["ingredients__measurement_unit"]}.')
-                y_position -= 15
-                if y_position <= 50:
-                    page.showPage()
-                    y_position = 800
-            page.save()
-            buffer.seek(0)
-            return FileResponse(
-                buffer, as_attachment=True, filename=DOCUMENT)
-        page.setFont('Vera', 24)
-        page.drawString(
-            x_position,
-            y_position,
-            'Ваш список покупок пуст.')
-        page.save()
-        buffer.seek(0)
-        return FileResponse(buffer, as_attachment=True, filename=DOCUMENT)
+        """ Функция для скачивания.
+        По умолчанию PDF, ?format=txt и ?format=csv отдаются потоком.
+        PDF формируется сразу. Клиент, умеющий ждать, передает ?async=1
+        или Prefer: respond-async: тогда большой PDF формируется в фоне,
+        пока файл не готов, возвращается 202 с заголовками Location
+        и Retry-After, и клиент повторяет запрос по тому же адресу.
+        Готовый файл и флаг задачи хранятся в общем кэше.
+        """
+
+        export_format = request.query_params.get('format')
+        if export_format in STREAM_FORMATS:
+            stream, content_type = STREAM_FORMATS[export_format]
+            response = StreamingHttpResponse(
+                stream(request.user), content_type=content_type)
+            response['Content-Disposition'] = (
+                f'attachment; filename="shoppingcart.{export_format}"')
+            return response
+        user_id = request.user.id
+        items = shopping_list.get_shopping_list(request.user)
+        digest = shopping_list.get_digest(items)
+        pdf = shopping_list.get_cached_pdf(user_id, digest)
+        if pdf is None:
+            if (not wants_async(request)
+                    or len(items) < settings.SHOPPING_CART_ASYNC_ROWS):
+                pdf = shopping_list.render_and_cache(user_id, digest, items)
+            else:
+                shopping_list.render_in_background(user_id, digest, items)
+                return Response(
+                    {'status': 'Список покупок формируется.'},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={
+                        'Location': request.build_absolute_uri(),
+                        'Retry-After': RETRY_AFTER,
+                        'Preference-Applied': 'respond-async'})
+        return FileResponse(
+            io.BytesIO(pdf), as_attachment=True, filename=DOCUMENT)
 
 
 class TagsViewSet(
+        ConditionalGetMixin,
         PermissionAndPaginationMixin,
         viewsets.ModelViewSet):
     """Вьюсет для тегов. Доступны:
@@ -291,9 +316,18 @@ class TagsViewSet(
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    conditional_tables = ('tag',)
+
+    def get_conditional_versions(self):
+        return [*super().get_conditional_versions(), catalog.get_tag_version()]
+
+    def get_pub_date(self):
+        tag = tag_catalog.get(self.kwargs['pk'])
+        return tag and tag.pub_date
 
 
 class IngredientsViewSet(
+        ConditionalGetMixin,
         PermissionAndPaginationMixin,
         viewsets.ModelViewSet):
     """Вьюсет для ингредиентов. Доступны:
@@ -305,6 +339,37 @@ class IngredientsViewSet(
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filterset_class = IngredientFilter
+    conditional_tables = ('ingredient',)
+
+    def get_conditional_versions(self):
+        """Версия каталога из БД: после загрузки ингредиентов другим
+        процессом ETag меняется вместе с самим списком."""
+        return [*super().get_conditional_versions(), catalog.get_version()]
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.list_catalog, request, *args, **kwargs)
+
+    def list_catalog(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        ingredients = ingredient_catalog.search(
+            name, settings.INGREDIENT_SEARCH_LIMIT
+        ) if name else ingredient_catalog.all()
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
+    def get_pub_date(self):
+        ingredient = ingredient_catalog.get(self.kwargs['pk'])
+        return ingredient and ingredient.pub_date
+
+    def get_object(self):
+        if self.request.method not in SAFE_METHODS:
+            return super().get_object()
+        ingredient = ingredient_catalog.get(self.kwargs['pk'])
+        if ingredient is None:
+            raise Http404
+        self.check_object_permissions(self.request, ingredient)
+        return ingredient
 
 
 @api_view(['post'])
@@ -322,3 +387,13 @@ def set_password(request):
     return Response(
         {'error': 'Ошибка'},
         status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['get'])
+@permission_classes((IsAdminUser,))
+def db_pool_stats(request):
+    """Счетчики пулов соединений с БД этого процесса для мониторинга:
+    занятые и свободные соединения, ожидающие запросы и время ожидания.
+    """
+
+    return Response(pool.get_stats())
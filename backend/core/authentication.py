@@ -0,0 +1,110 @@
+"""Аутентификация по токену с кэшем пользователей.
+По умолчанию снимки пользователей хранятся в ограниченном LRU внутри
+процесса. Если задан TOKEN_CACHE_ALIAS, используется общий кэш Django,
+и выход из системы, смена пароля или блокировка видны всем воркерам
+сразу. Записи сбрасываются сигналами из api.signals.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+CACHE_KEY = 'auth_token:{key}'
+
+
+class TokenCache:
+    """Снимки пользователей по ключу токена с ограничением по размеру
+    и времени жизни записи.
+    """
+
+    def __init__(self, size, timeout, alias=None):
+        self.size = size
+        self.timeout = timeout
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def get(self, key):
+        if self.shared is not None:
+            return self.shared.get(CACHE_KEY.format(key=key))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.copy(user)
+
+    def set(self, key, user):
+        if self.shared is not None:
+            self.shared.set(CACHE_KEY.format(key=key), user, self.timeout)
+            return
+        with self._lock:
+            self._entries[key] = (
+                copy.copy(user), time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys):
+        keys = list(keys)
+        if self.shared is not None:
+            self.shared.delete_many(
+                [CACHE_KEY.format(key=key) for key in keys])
+            return
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(
+    settings.TOKEN_CACHE_SIZE,
+    settings.TOKEN_CACHE_TIMEOUT,
+    settings.TOKEN_CACHE_ALIAS)
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который обращается к БД только при промахе
+    кэша токенов. Токен читается из основной БД: только что выданный
+    токен может еще не дойти до реплики.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            try:
+                token = Token.objects.using(
+                    router.db_for_write(Token)
+                ).select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise AuthenticationFailed(_('User inactive or deleted.'))
+            token_cache.set(key, token.user)
+            return token.user, token
+        return user, Token(key=key, user=user)
+
+
+def invalidate_user_tokens(user_id):
+    """Сбрасывает кэш всех токенов пользователя."""
+    token_cache.delete(
+        Token.objects.filter(user_id=user_id).values_list('key', flat=True))
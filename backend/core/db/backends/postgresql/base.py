@@ -0,0 +1,76 @@
+"""PostgreSQL с проверкой постоянных соединений и пулом.
+CONN_HEALTH_CHECKS: соединение, оставшееся с прошлого запроса, перед
+первым использованием проверяется SELECT 1 и при ошибке открывается
+заново. POOL: {'MAX_SIZE': ..., 'TIMEOUT': ...} включает пул процесса
+(core.db.pool), закрытие соединения возвращает его в пул.
+"""
+from django.db.backends.postgresql import base
+
+from core.db.pool import PoolTimeout, get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    health_check_enabled = False
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get('POOL')
+        if not options:
+            return None
+        return get_pool(self.alias, options['MAX_SIZE'], options['TIMEOUT'])
+
+    def is_connection_usable(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except self.Database.Error:
+            return False
+        return True
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        health_checks = self.settings_dict.get('CONN_HEALTH_CHECKS')
+        while True:
+            try:
+                connection = pool.acquire(
+                    lambda: super(DatabaseWrapper, self).get_new_connection(
+                        conn_params))
+            except PoolTimeout as error:
+                raise self.Database.OperationalError(str(error))
+            if not health_checks or self.is_connection_usable(connection):
+                break
+            pool.release(connection, discard=True)
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None:
+            return super()._close()
+        discard = bool(self.errors_occurred or self.connection.closed)
+        if not discard:
+            try:
+                self.connection.rollback()
+            except self.Database.Error:
+                discard = True
+        pool.release(self.connection, discard=discard)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_enabled = bool(
+            self.settings_dict.get('CONN_HEALTH_CHECKS')
+            and self.connection is not None)
+
+    def ensure_connection(self):
+        if self.health_check_enabled:
+            self.health_check_enabled = False
+            if not self.in_atomic_block and not self.is_usable():
+                self.errors_occurred = True
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,101 @@
+"""Пул соединений с БД внутри процесса.
+Пул не зависит от драйвера: соединение создается переданной фабрикой.
+Свободные соединения переиспользуются, число выданных ограничено
+max_size, а запрос сверх лимита ждет освобождения не дольше timeout
+секунд. Счетчики пула отдаются в get_stats() для мониторинга.
+"""
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._in_use = 0
+        self._waiting = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def acquire(self, connect):
+        """Возвращает свободное соединение или создает новое фабрикой
+        connect, если лимит не исчерпан.
+        """
+        start = time.monotonic()
+        with self._condition:
+            self._waiting += 1
+            try:
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f'Нет свободных соединений за {self.timeout} с '
+                            f'(занято {self._in_use} из {self.max_size}).')
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+                waited = time.monotonic() - start
+                self._wait_time += waited
+                self._max_wait_time = max(self._max_wait_time, waited)
+            self._acquired += 1
+            self._in_use += 1
+            connection = self._idle.pop() if self._idle else None
+        if connection is None:
+            try:
+                connection = connect()
+            except Exception:
+                self.release(None, discard=True)
+                raise
+        return connection
+
+    def release(self, connection, discard=False):
+        """Возвращает соединение в пул или закрывает его при discard."""
+        with self._condition:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append(connection)
+            self._condition.notify()
+        if discard and connection is not None:
+            connection.close()
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'acquired': self._acquired,
+                'timeouts': self._timeouts,
+                'wait_time_ms': round(self._wait_time * 1000, 2),
+                'max_wait_time_ms': round(self._max_wait_time * 1000, 2),
+            }
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, max_size, timeout):
+    """Пул для подключения alias, создается при первом обращении."""
+    with pools_lock:
+        if alias not in pools:
+            pools[alias] = ConnectionPool(max_size, timeout)
+        return pools[alias]
+
+
+def get_stats():
+    """Счетчики всех пулов процесса: {alias: {...}}."""
+    with pools_lock:
+        return {alias: pool.get_stats() for alias, pool in pools.items()}
@@ -0,0 +1,40 @@
+"""Чтение с реплик БД.
+ReplicaMiddleware разрешает чтение с реплик только для безопасных
+методов. После изменяющего запроса клиент на DB_REPLICA_PIN_SECONDS
+закрепляется за основной БД, чтобы сразу видеть свои изменения, пока
+реплика догоняет основную БД.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+replica_allowed = ContextVar('replica_allowed', default=False)
+
+
+@contextmanager
+def read_from_primary():
+    """Все чтения внутри блока, включая prefetch, идут в основную БД."""
+    token = replica_allowed.set(False)
+    try:
+        yield
+    finally:
+        replica_allowed.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if replica_allowed.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
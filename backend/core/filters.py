@@ -1,35 +1,113 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db.models import Case, IntegerField, Value, When
 import django_filters as filters
+from django_filters.constants import EMPTY_VALUES
 
 from users.models import User
-from recipes.models import Ingredient, Recipe
+from recipes import search
+from recipes.catalog import ingredient_catalog, tag_catalog
+from recipes.models import FavoriteRecipe, Ingredient, Recipe, ShoppingCart
 
 
 class IngredientFilter(filters.FilterSet):
     """Добавляет возможность поиска по ингредиентам.
-    Поиск частичному вхождению в начале названия ингредиента.
+    Поиск по частичному вхождению в название ингредиента:
+    сначала совпадения с начала названия, затем остальные.
+    Ранжирование берется из каталога ингредиентов в памяти.
     """
-    name = filters.CharFilter(lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
 
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def filter_name(self, queryset, name, value):
+        ids = [
+            ingredient.id for ingredient in ingredient_catalog.search(
+                value, settings.INGREDIENT_SEARCH_LIMIT)]
+        return queryset.filter(id__in=ids).order_by(Case(
+            *(When(id=pk, then=Value(position))
+              for position, pk in enumerate(ids)),
+            output_field=IntegerField()))
+
+
+class StableOrderingFilter(filters.OrderingFilter):
+    """Сортировка с досортировкой по дате и id: при равных значениях
+    страницы не пересекаются."""
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return qs.order_by(
+            *(self.get_ordering_value(param) for param in value),
+            '-pub_date', '-id')
+
+
+def get_tag_choices():
+    """Функция, а не метод каталога: FilterSet копирует фильтры
+    через deepcopy."""
+    return tag_catalog.choices()
+
 
 class RecipeFilter(filters.FilterSet):
+    """Фильтры списка рецептов. Теги, избранное и корзина отбираются
+    подзапросами по индексам связующих таблиц, без JOIN и DISTINCT.
+    Варианты тегов берутся из каталога тегов в памяти.
+    """
+    search = filters.CharFilter(
+        method='filter_search',
+        label='Поиск')
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all())
     is_in_shopping_cart = filters.BooleanFilter(
+        method='filter_is_in_shopping_cart',
         widget=filters.widgets.BooleanWidget(),
         label='В корзине.')
     is_favorited = filters.BooleanFilter(
+        method='filter_is_favorited',
         widget=filters.widgets.BooleanWidget(),
         label='В избранных.')
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags',
         label='Ссылка')
+    ordering = StableOrderingFilter(
+        fields=('favorites_count', 'in_carts_count', 'pub_date'),
+        label='Сортировка')
 
     class Meta:
         model = Recipe
         fields = ['is_favorited', 'is_in_shopping_cart', 'author', 'tags']
+
+    def filter_tags(self, queryset, name, value):
+        """Рецепты с любым из тегов."""
+        return queryset.filter(
+            id__in=Recipe.tags.through.objects.filter(
+                tag_id__in=tag_catalog.get_ids(value)
+            ).values('recipe_id'))
+
+    def filter_user_recipes(self, queryset, model, value):
+        """Рецепты из избранного или корзины пользователя (value=True)
+        или не из них (value=False)."""
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        recipe_ids = model.recipe.through.objects.filter(
+            **{f'{model._meta.model_name}__user': user}
+        ).values('recipe_id')
+        if value:
+            return queryset.filter(id__in=recipe_ids)
+        return queryset.exclude(id__in=recipe_ids)
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_recipes(queryset, FavoriteRecipe, value)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_recipes(queryset, ShoppingCart, value)
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск с сортировкой по релевантности,
+        ?ordering= ее переопределяет."""
+        return search.search(queryset, value)
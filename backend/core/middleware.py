@@ -0,0 +1,59 @@
+import hashlib
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+from core.db.router import replica_allowed
+
+PIN_COOKIE = 'replica_pin'
+PIN_SALT = 'core.middleware.ReplicaMiddleware'
+
+
+def get_client_key(request):
+    """Клиент определяется по токену или сессии: middleware срабатывает
+    до аутентификации DRF, и request.user еще неизвестен. Адрес клиента
+    не используется: за прокси он общий для всех анонимных клиентов.
+    """
+    client = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not client:
+        return None
+    return hashlib.sha1(client.encode()).hexdigest()
+
+
+def is_pinned(request, client):
+    """Закрепление хранится в подписанной cookie с ключом клиента,
+    поэтому его видят все процессы, а срок проверяется по подписи.
+    """
+    return request.get_signed_cookie(
+        PIN_COOKIE, default=None, salt=PIN_SALT,
+        max_age=settings.DB_REPLICA_PIN_SECONDS) == client
+
+
+class ReplicaMiddleware:
+    """Направляет чтение безопасных запросов на реплики, а запросы
+    клиента после его изменений на основную БД. Клиенты без токена
+    и сессии не закрепляются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        client = get_client_key(request)
+        safe = request.method in SAFE_METHODS
+        token = replica_allowed.set(
+            safe and not (client and is_pinned(request, client)))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_allowed.reset(token)
+        if not safe and client:
+            response.set_signed_cookie(
+                PIN_COOKIE, client, salt=PIN_SALT,
+                max_age=settings.DB_REPLICA_PIN_SECONDS, httponly=True,
+                samesite='Lax')
+        return response
@@ -1,6 +1,18 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from core import versions
 from core.permissions import IsAdminOrReadOnly
 from rest_framework import generics
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.http import http_date
+from rest_framework.response import Response
 User = get_user_model()
 
 class PermissionAndPaginationMixin:
@@ -18,7 +30,139 @@ class RetrieveDestroyListCreate(
 class GetIsSubscribedMixin:
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
         if not user.is_authenticated:
             return False
         return user.follower.filter(author=obj).exists()
+
+
+class ConditionalGetMixin:
+    """Отвечает 304 на If-None-Match/If-Modified-Since без сериализации.
+    ETag и Last-Modified считаются по счетчикам изменений таблиц
+    conditional_tables и дате публикации объекта, сам queryset не
+    загружается.
+    """
+
+    conditional_tables = ()
+    conditional_actions = ('list', 'retrieve')
+    conditional_per_user = False
+
+    def get_pub_date(self):
+        """Дата публикации запрошенного объекта без загрузки строки.
+        Для некорректного значения в URL возвращает None: ответ 404
+        дает get_object_or_404, как и без условного GET.
+        """
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return self.queryset.model.objects.filter(
+                **{self.lookup_field: self.kwargs[lookup]}
+            ).values_list('pub_date', flat=True).first()
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def get_conditional_versions(self):
+        return versions.get_versions(self.conditional_tables)
+
+    def get_conditional_headers(self):
+        stamps = self.get_conditional_versions()
+        last_modified = max(stamps) // 10 ** 6
+        if self.action == 'retrieve':
+            pub_date = self.get_pub_date()
+            if pub_date is None:
+                return None, None
+            last_modified = max(last_modified, int(pub_date.timestamp()))
+        parts = [self.request.get_full_path(), *map(str, stamps)]
+        if self.conditional_per_user:
+            parts.append(str(self.request.user.pk))
+        etag = quote_etag(hashlib.sha1('|'.join(parts).encode()).hexdigest())
+        return etag, last_modified
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = self.get_conditional_headers()
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            if self.conditional_per_user:
+                patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+class ResponseCacheMixin:
+    """Общий кэш ответов list/retrieve для анонимных пользователей.
+    Ключ строится по пути и нормализованным параметрам запроса, запись
+    хранит счетчики изменений response_cache_tables и устаревает, как
+    только сигналы моделей их сдвинут. При промахе ответ пересчитывает
+    один воркер: остальные отдают устаревшую запись или ждут свежую.
+    """
+
+    response_cache_tables = ()
+    response_cache_actions = ('list', 'retrieve')
+
+    def get_response_cache_key(self):
+        params = sorted(
+            (key, value)
+            for key, values in self.request.query_params.lists()
+            for value in set(values) if value)
+        url = self.request.build_absolute_uri(self.request.path)
+        return 'response_cache:' + hashlib.sha1(
+            f'{url}?{urlencode(params)}'.encode()).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if (self.action not in self.response_cache_actions
+                or request.user.is_authenticated):
+            return handler(request, *args, **kwargs)
+        key = self.get_response_cache_key()
+        stamps = versions.get_versions(self.response_cache_tables)
+        entry = cache.get(key)
+        if entry and entry['versions'] == stamps:
+            return Response(entry['data'])
+        lock_key = f'{key}:lock'
+        timeout = settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        locked = cache.add(lock_key, True, timeout)
+        if not locked:
+            if entry:
+                return Response(entry['data'])
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                time.sleep(settings.RESPONSE_CACHE_WAIT_INTERVAL)
+                entry = cache.get(key)
+                if entry and entry['versions'] == stamps:
+                    return Response(entry['data'])
+                if not cache.get(lock_key):
+                    break
+        try:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(
+                    key, {'versions': stamps, 'data': response.data},
+                    settings.RESPONSE_CACHE_TIMEOUT)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
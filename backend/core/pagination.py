@@ -1,6 +1,83 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import remove_query_param
+
+
+def approximate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL.
+    На других СУБД считается точный COUNT(*).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        return cursor.fetchone()[0][0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация по (pub_date, id) без COUNT(*) и OFFSET.
+    Общее количество добавляется по ?with_count=1 и является оценкой,
+    в ссылки на соседние страницы параметр не переносится.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    count_query_param = 'with_count'
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = approximate_count(queryset)
+        page = super().paginate_queryset(queryset, request, view)
+        self.base_url = remove_query_param(
+            self.base_url, self.count_query_param)
+        return page
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+
+def get_ordering(queryset):
+    """Явная сортировка queryset без повторяющихся полей."""
+    return tuple(dict.fromkeys(queryset.query.order_by))
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация page/limit.
+    Если вьюсет задает cursor_ordering и в запросе есть параметр cursor
+    (в том числе пустой — первая страница), используется KeysetPagination.
+    Курсор задает порядок сам, поэтому другая сортировка запроса
+    (?ordering=) вместе с cursor - ошибка 400, а не молча
+    подмененный порядок.
+    """
+
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    keyset_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering and self.cursor_query_param in request.query_params:
+            if get_ordering(queryset) not in ((), tuple(ordering)):
+                raise ValidationError({self.cursor_query_param: (
+                    'Курсорная пагинация доступна только при сортировке '
+                    'по дате публикации, используйте page.')})
+            self.keyset_paginator = KeysetPagination(ordering)
+            return self.keyset_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,51 @@
+"""Первые N связанных строк для каждого родителя одним запросом.
+Строки нумеруются оконной функцией
+ROW_NUMBER() OVER (PARTITION BY <родитель> ORDER BY ...), и в выборку
+попадают только номера не больше N, поэтому ограничение выполняет БД,
+а не срез в Python на каждого родителя.
+"""
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+
+def get_order_by(field):
+    if field.startswith('-'):
+        return F(field[1:]).desc()
+    return F(field).asc()
+
+
+def top_per_group(queryset, group_by, ordering, limit):
+    """Оставляет в queryset не более limit строк для каждого значения
+    поля group_by, первых в порядке ordering.
+    """
+    ranked = queryset.order_by().annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=F(group_by),
+            order_by=[get_order_by(field) for field in ordering])
+    ).values('position', row_id=F('pk'))
+    sql, params = ranked.query.get_compiler(queryset.db).as_sql()
+    return queryset.filter(
+        pk__in=RawSQL(
+            f'SELECT ranked.row_id FROM ({sql}) ranked '
+            f'WHERE ranked.position <= %s',
+            (*params, limit))
+    ).order_by(group_by, *ordering)
+
+
+def prefetch_top(instances, queryset, group_by, ordering, limit, to_attr):
+    """Записывает в атрибут to_attr каждого объекта instances список
+    из не более limit строк queryset, у которых внешний ключ group_by
+    ссылается на этот объект.
+    """
+    groups = {instance.pk: [] for instance in instances}
+    if not groups:
+        return
+    attname = queryset.model._meta.get_field(group_by).attname
+    for row in top_per_group(
+            queryset.filter(**{f'{group_by}__in': list(groups)}),
+            group_by, ordering, limit):
+        groups[getattr(row, attname)].append(row)
+    for instance in instances:
+        setattr(instance, to_attr, groups[instance.pk])
@@ -0,0 +1,26 @@
+"""Колонка tsvector для полнотекстового поиска PostgreSQL.
+django.contrib.postgres.search в Django 3.2 импортирует psycopg2 при
+загрузке модуля, поэтому поле и оператор @@ объявлены здесь: модели
+загружаются и на SQLite, где колонка остается пустой.
+"""
+from django.db import models
+
+
+class SearchVectorField(models.Field):
+    """Вычисляемая колонка tsvector, заполняется запросом UPDATE."""
+
+    def db_type(self, connection):
+        return 'tsvector'
+
+
+@SearchVectorField.register_lookup
+class Matches(models.Lookup):
+    """search_vector__matches=SearchQuery(...): оператор @@,
+    использующий GIN-индекс колонки."""
+
+    lookup_name = 'matches'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} @@ {rhs}', (*lhs_params, *rhs_params)
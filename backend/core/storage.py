@@ -0,0 +1,79 @@
+"""Хранилище файлов с адресацией по содержимому.
+Имя файла - sha256 его байтов, разложенный по подкаталогам из первых
+символов хэша: recipes/ab/cd/abcd....jpg. Одинаковые файлы хранятся
+один раз, повторное сохранение возвращает имя существующего.
+Удалять файл можно, только когда на него не осталось ссылок
+(recipes.blobs).
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_NAME = re.compile(
+    r'^(?:.*/)?([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.\w+$')
+CHUNK_SIZE = 64 * 1024
+FILE_MODE = 0o644
+
+
+def get_digest(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_content_name(self, name, content):
+        """Адрес файла в каталоге, заданном name."""
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        digest = get_digest(content)
+        return '/'.join(filter(None, (
+            directory, digest[:2], digest[2:4], f'{digest}{extension}')))
+
+    def is_addressed(self, name):
+        return bool(name and HASH_NAME.match(name))
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        """Пишет во временный файл и атомарно переименовывает:
+        одновременная запись тех же байтов дает тот же результат.
+        """
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    file.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or FILE_MODE)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
@@ -0,0 +1,76 @@
+"""Счетчики изменений таблиц в общем кэше.
+Значение счетчика — время последнего изменения в микросекундах, поэтому
+оно же служит источником Last-Modified. Если счетчик вытеснен из кэша,
+он заводится заново текущим временем: клиенты просто перезапросят данные.
+Кэш должен быть общим для всех процессов: иначе изменение, сделанное
+в одном воркере или в команде manage.py, не сдвинет счетчик в другом,
+и тот продолжит отдавать 304 и закэшированные ответы.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+KEY = 'table_version:{table}'
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_cache_backend():
+    """Без DEBUG запрещает кэш, который виден только своему процессу."""
+    backend = settings.CACHES['default']['BACKEND']
+    if not settings.DEBUG and backend in PROCESS_LOCAL_BACKENDS:
+        raise ImproperlyConfigured(
+            f'Кэш {backend} не общий для процессов: счетчики изменений '
+            'разойдутся между воркерами. Задайте CACHE_BACKEND, например '
+            'django.core.cache.backends.filebased.FileBasedCache.')
+
+
+def now():
+    return time.time_ns() // 1000
+
+
+def get_versions(tables):
+    keys = [KEY.format(table=table) for table in tables]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, now(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_version(table):
+    return get_versions((table,))[0]
+
+
+def bump_version(table):
+    key = KEY.format(table=table)
+    cache.set(key, max(now(), (cache.get(key) or 0) + 1), None)
+
+
+def get_row_table(table, pk):
+    """Счетчик отдельной строки таблицы, например recipe:5."""
+    return f'{table}:{pk}'
+
+
+def bump_versions(tables):
+    """Сдвигает счетчики сразу и еще раз после коммита: данные,
+    закэшированные другим запросом до коммита, тоже устареют.
+    """
+    tables = list(tables)
+
+    def bump():
+        for table in tables:
+            bump_version(table)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def bump_row_versions(table, pks):
+    bump_versions(get_row_table(table, pk) for pk in set(pks))
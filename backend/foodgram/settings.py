@@ -1,5 +1,6 @@
 import os
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -44,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -67,10 +69,24 @@ TEMPLATES = [
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 
+DB_ENGINE = os.getenv(
+    'DB_ENGINE', default='core.db.backends.postgresql')
+DB_POOL_MAX_SIZE = int(os.getenv(
+    'DB_POOL_MAX_SIZE', default='0'))
+# Пул и проверку соединений умеет только свой бэкенд, стандартный
+# бэкенд Django 3.2 молча игнорирует эти настройки.
+DB_POOLED_ENGINE = DB_ENGINE == 'core.db.backends.postgresql'
+DB_CONN_HEALTH_CHECKS = os.getenv(
+    'DB_CONN_HEALTH_CHECKS',
+    default=str(DB_POOLED_ENGINE)) == 'True'
+if not DB_POOLED_ENGINE and (DB_POOL_MAX_SIZE or DB_CONN_HEALTH_CHECKS):
+    raise ImproperlyConfigured(
+        'DB_POOL_MAX_SIZE и DB_CONN_HEALTH_CHECKS работают только '
+        f'с core.db.backends.postgresql, задан {DB_ENGINE}.')
+
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv(
-            'DB_ENGINE', default='django.db.backends.postgresql'),
+        'ENGINE': DB_ENGINE,
         'NAME': os.getenv(
             'POSTGRES_DB',
             default='postgres'),
@@ -86,8 +102,34 @@ DATABASES = {
         'PORT': os.getenv(
             'DB_PORT',
             default='5432'),
+        'CONN_MAX_AGE': int(os.getenv(
+            'DB_CONN_MAX_AGE',
+            default='60' if DB_POOLED_ENGINE and not DB_POOL_MAX_SIZE
+            else '0')),
+        'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
+        'POOL': {
+            'MAX_SIZE': DB_POOL_MAX_SIZE,
+            'TIMEOUT': float(os.getenv(
+                'DB_POOL_TIMEOUT',
+                default='5')),
+        } if DB_POOL_MAX_SIZE else None,
     }}
 
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.getenv(
+        'DB_REPLICA_HOSTS', default='').split(','))):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['core.db.router.ReplicaRouter']
+
+DB_REPLICA_PIN_SECONDS = int(os.getenv(
+    'DB_REPLICA_PIN_SECONDS', default='10'))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -129,7 +171,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachingTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -138,3 +180,68 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'core.pagination.CustomPagination',
     'PAGE_SIZE': 6,
 }
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default='foodgram'),
+    }}
+# Локальные, файловый и табличный кэши по умолчанию держат 300 записей,
+# чего не хватает на тела рецептов; клиентам memcached опция не нужна.
+if CACHES['default']['BACKEND'].rsplit('.', 2)[-2] in (
+        'locmem', 'filebased', 'db'):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default='10000'))}
+
+SHOPPING_CART_CACHE_TIMEOUT = int(os.getenv(
+    'SHOPPING_CART_CACHE_TIMEOUT', default='3600'))
+SHOPPING_CART_ASYNC_ROWS = int(os.getenv(
+    'SHOPPING_CART_ASYNC_ROWS', default='300'))
+SHOPPING_CART_RENDER_WORKERS = int(os.getenv(
+    'SHOPPING_CART_RENDER_WORKERS', default='2'))
+SHOPPING_CART_RENDER_TIMEOUT = int(os.getenv(
+    'SHOPPING_CART_RENDER_TIMEOUT', default='60'))
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv(
+    'INGREDIENT_SEARCH_LIMIT', default='20'))
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv(
+    'RESPONSE_CACHE_TIMEOUT', default='300'))
+RESPONSE_CACHE_LOCK_TIMEOUT = int(os.getenv(
+    'RESPONSE_CACHE_LOCK_TIMEOUT', default='10'))
+RESPONSE_CACHE_WAIT_INTERVAL = float(os.getenv(
+    'RESPONSE_CACHE_WAIT_INTERVAL', default='0.05'))
+RECIPE_FRAGMENT_TIMEOUT = int(os.getenv(
+    'RECIPE_FRAGMENT_TIMEOUT', default='3600'))
+
+SUBSCRIPTION_RECIPES_LIMIT = int(os.getenv(
+    'SUBSCRIPTION_RECIPES_LIMIT', default='3'))
+SUBSCRIPTION_RECIPES_MAX_LIMIT = int(os.getenv(
+    'SUBSCRIPTION_RECIPES_MAX_LIMIT', default='50'))
+
+TOKEN_CACHE_SIZE = int(os.getenv(
+    'TOKEN_CACHE_SIZE', default='10000'))
+TOKEN_CACHE_TIMEOUT = int(os.getenv(
+    'TOKEN_CACHE_TIMEOUT', default='300'))
+TOKEN_CACHE_ALIAS = os.getenv(
+    'TOKEN_CACHE_ALIAS', default='')
+
+IMAGE_PIPELINE_ASYNC = os.getenv(
+    'IMAGE_PIPELINE_ASYNC', default='True') == 'True'
+IMAGE_PIPELINE_WORKERS = int(os.getenv(
+    'IMAGE_PIPELINE_WORKERS', default='2'))
+IMAGE_MAX_UPLOAD_SIZE = int(os.getenv(
+    'IMAGE_MAX_UPLOAD_SIZE', default=str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv(
+    'IMAGE_MAX_PIXELS', default='40000000'))
+IMAGE_MAX_SIZE = int(os.getenv(
+    'IMAGE_MAX_SIZE', default='1600'))
+IMAGE_THUMBNAIL_WIDTHS = [
+    int(width) for width in os.getenv(
+        'IMAGE_THUMBNAIL_WIDTHS', default='320,640,960').split(',')]
+IMAGE_QUALITY = int(os.getenv(
+    'IMAGE_QUALITY', default='85'))
@@ -1,4 +1,7 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from recipes import images, shopping_totals
 from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
                             RecipeIngredient, ShoppingCart, Subscribe, Tag)
 
@@ -11,20 +14,73 @@ class RecipeIngredientAdmin(admin.StackedInline):
     min_num = 1
 
 
+class RecipeAdminForm(forms.ModelForm):
+    """Картинка загружается отдельным полем и проходит ту же обработку,
+    что и через API: хэш содержимого, ссылки, миниатюры."""
+
+    upload = forms.FileField(
+        label='Загрузить картинку',
+        required=False)
+
+    class Meta:
+        model = Recipe
+        exclude = ('image',)
+
+    def clean_upload(self):
+        upload = self.cleaned_data.get('upload')
+        if upload is None:
+            return None
+        if upload.size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise forms.ValidationError('Слишком большой файл.')
+        data = upload.read()
+        try:
+            images.read_header(data)
+        except ValueError as error:
+            raise forms.ValidationError(str(error))
+        return data
+
+
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = (
         'author',
-        'name'
+        'name',
+        'favorites_count',
+        'in_carts_count'
     )
+    list_select_related = ('author',)
     list_filter = (
         'author',
         'name',
         'tags'
     )
+    form = RecipeAdminForm
+    readonly_fields = (
+        'image', 'image_width', 'image_height',
+        'favorites_count', 'in_carts_count')
     inlines = (RecipeIngredientAdmin,)
     empty_value_display = EMPTY
 
+    def save_model(self, request, obj, form, change):
+        """Сохраняет только измененные поля: счетчики меняют сигналы,
+        картинку с миниатюрами - images.attach и фоновая обработка."""
+        if not change:
+            super().save_model(request, obj, form, change)
+        else:
+            fields = {field.name for field in obj._meta.concrete_fields}
+            changed = [
+                name for name in form.changed_data if name in fields]
+            if changed:
+                obj.save(update_fields=changed)
+        if form.cleaned_data.get('upload'):
+            images.attach(obj, form.cleaned_data['upload'])
+
+    def save_related(self, request, form, formsets, change):
+        cart_user_ids = shopping_totals.get_cart_user_ids(form.instance)
+        shopping_totals.change_totals(cart_user_ids, [form.instance.id], -1)
+        super().save_related(request, form, formsets, change)
+        shopping_totals.change_totals(cart_user_ids, [form.instance.id], 1)
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
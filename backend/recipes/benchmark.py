@@ -0,0 +1,236 @@
+"""Нагрузочный стенд API.
+Заполняет БД синтетическими данными и прогоняет эндпоинты через
+тестовый клиент DRF, замеряя число запросов, задержку и пик памяти.
+Число запросов и память замеряются дважды: с прогретыми кэшами
+и после их очистки (метрики cold_*), чтобы регрессии на первом
+запросе не прятались за кэшем.
+"""
+import csv
+import json
+import math
+import os
+import random
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import token_cache
+from recipes.catalog import bump_tag_version, bump_version
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Subscribe, Tag)
+
+User = get_user_model()
+
+BUDGETS_PATH = os.path.join(
+    settings.BASE_DIR, 'data', 'benchmark_budgets.json')
+BATCH_SIZE = 5000
+TAGS = (
+    {'name': 'Завтрак', 'color': '#E26C2D', 'slug': 'breakfast'},
+    {'name': 'Обед', 'color': '#49B64E', 'slug': 'dinner'},
+    {'name': 'Ужин', 'color': '#8775D2', 'slug': 'supper'})
+
+
+def load_dataset(users=2000, recipes=20000, ingredients_per_recipe=8,
+                 subscriptions=50, cart_size=30, seed=0):
+    """Создает синтетический набор данных и возвращает читателя:
+    пользователя с подписками, избранным и заполненной корзиной.
+    """
+    rng = random.Random(seed)
+    with open(
+        os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+        'r',
+        encoding='utf-8'
+    ) as file:
+        Ingredient.objects.bulk_create(
+            (Ingredient(**data) for data in csv.DictReader(file)),
+            batch_size=BATCH_SIZE)
+    bump_version()
+    Tag.objects.bulk_create(Tag(**tag) for tag in TAGS)
+    bump_tag_version()
+    User.objects.bulk_create(
+        (User(
+            username=f'user{index}',
+            email=f'user{index}@foodgram.ru',
+            first_name='Имя',
+            last_name='Фамилия')
+         for index in range(users)),
+        batch_size=BATCH_SIZE)
+    user_ids = list(User.objects.values_list('id', flat=True))
+    ShoppingCart.objects.bulk_create(
+        (ShoppingCart(user_id=user_id) for user_id in user_ids),
+        batch_size=BATCH_SIZE)
+    FavoriteRecipe.objects.bulk_create(
+        (FavoriteRecipe(user_id=user_id) for user_id in user_ids),
+        batch_size=BATCH_SIZE)
+    Recipe.objects.bulk_create(
+        (Recipe(
+            author_id=rng.choice(user_ids),
+            name=f'Рецепт {index}',
+            text='Описание рецепта',
+            cooking_time=rng.randint(1, 180))
+         for index in range(recipes)),
+        batch_size=BATCH_SIZE)
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    RecipeIngredient.objects.bulk_create(
+        (RecipeIngredient(
+            recipe_id=recipe_id,
+            ingredient_id=ingredient_id,
+            amount=rng.randint(1, 999))
+         for recipe_id in recipe_ids
+         for ingredient_id in rng.sample(
+             ingredient_ids, ingredients_per_recipe)),
+        batch_size=BATCH_SIZE)
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+         for recipe_id in recipe_ids
+         for tag_id in rng.sample(tag_ids, rng.randint(1, len(tag_ids)))),
+        batch_size=BATCH_SIZE)
+    reader = User.objects.get(id=user_ids[0])
+    Subscribe.objects.bulk_create(
+        Subscribe(user=reader, author_id=author_id)
+        for author_id in rng.sample(user_ids[1:], subscriptions))
+    reader.shopping_cart.recipe.add(*rng.sample(recipe_ids, cart_size))
+    reader.favorite_recipe.recipe.add(*rng.sample(recipe_ids, cart_size))
+    return reader
+
+
+def get_scenarios(reader):
+    """Возвращает сценарии: имя, метод, путь, ожидаемый статус,
+    функцию восстановления данных после запроса и нужна ли авторизация.
+    """
+    author = reader.follower.values_list('author', flat=True).first()
+    target = User.objects.exclude(id=reader.id).exclude(
+        following__user=reader).values_list('id', flat=True).first()
+    recipe = Recipe.objects.values_list('id', flat=True).first()
+
+    def unsubscribe():
+        Subscribe.objects.filter(user=reader, author_id=target).delete()
+
+    def resubscribe():
+        Subscribe.objects.get_or_create(user=reader, author_id=target)
+
+    return (
+        ('recipes_list_anonymous', 'get', '/api/recipes/?limit=50',
+         200, None, False),
+        ('recipes_list', 'get', '/api/recipes/?limit=50',
+         200, None, True),
+        ('recipes_list_by_tags', 'get',
+         '/api/recipes/?tags=breakfast&tags=dinner&limit=50',
+         200, None, True),
+        ('recipes_list_by_author', 'get',
+         f'/api/recipes/?author={author}&limit=50',
+         200, None, True),
+        ('recipe_detail', 'get', f'/api/recipes/{recipe}/',
+         200, None, True),
+        ('subscriptions', 'get',
+         '/api/users/subscriptions/?limit=10&recipes_limit=3',
+         200, None, True),
+        ('subscribe', 'post', f'/api/users/{target}/subscribe/',
+         201, unsubscribe, True),
+        ('unsubscribe', 'delete', f'/api/users/{target}/subscribe/',
+         204, resubscribe, True),
+        ('download_shopping_cart', 'get',
+         '/api/recipes/download_shopping_cart/',
+         200, None, True),
+    )
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def measure(request, restore, cold):
+    """Число запросов и пик памяти (КБ) одного вызова request.
+    При cold кэши очищаются перед каждым замером.
+    """
+    if cold:
+        cache.clear()
+        token_cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        request()
+    query_count = len(queries)
+    if restore:
+        restore()
+    if cold:
+        cache.clear()
+        token_cache.clear()
+    tracemalloc.start()
+    request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if restore:
+        restore()
+    return query_count, round(peak / 1024, 1)
+
+
+def run_benchmark(reader, repeat=20, stdout=None):
+    """Прогоняет все сценарии и возвращает метрики по каждому."""
+    token, _ = Token.objects.get_or_create(user=reader)
+    results = {}
+    for name, method, path, status, restore, auth in get_scenarios(reader):
+        client = APIClient()
+        if auth:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = getattr(client, method)(path)
+            timings.append((time.perf_counter() - start) * 1000)
+            if restore:
+                restore()
+        if response.status_code != status:
+            raise AssertionError(
+                f'{name}: ожидался статус {status}, '
+                f'получен {response.status_code}')
+
+        def request():
+            getattr(client, method)(path)
+
+        query_count, peak = measure(request, restore, cold=False)
+        cold_query_count, cold_peak = measure(request, restore, cold=True)
+        results[name] = {
+            'queries': query_count,
+            'cold_queries': cold_query_count,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'peak_memory_kb': peak,
+            'cold_peak_memory_kb': cold_peak,
+        }
+        if stdout:
+            stdout.write(f'{name}: {results[name]}')
+    return results
+
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def check_budgets(results, budgets, metrics=None):
+    """Возвращает список превышений бюджетов.
+    metrics ограничивает проверку перечисленными метриками.
+    """
+    errors = []
+    for name, budget in budgets.items():
+        if name not in results:
+            errors.append(f'{name}: сценарий не выполнялся')
+            continue
+        for metric, limit in budget.items():
+            if metrics is not None and metric not in metrics:
+                continue
+            value = results[name][metric]
+            if value > limit:
+                errors.append(f'{name}: {metric} = {value} > {limit}')
+    return errors
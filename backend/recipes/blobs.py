@@ -0,0 +1,148 @@
+"""Ссылки рецептов на файлы в хранилище по хэшу.
+Одинаковые картинки разных рецептов хранятся одним файлом.
+MediaBlob.refs считает ссылки на файл из Recipe.image и
+Recipe.thumbnails. Ссылка добавляется до записи файла в той же
+транзакции, а файл удаляется после коммита под блокировкой строки,
+только если ссылок на него так и не появилось.
+"""
+import os
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from core import versions
+from recipes.models import MediaBlob, Recipe
+
+image_field = Recipe._meta.get_field('image')
+storage = image_field.storage
+
+
+def get_names(recipe):
+    """Файлы рецепта: картинка и миниатюры."""
+    names = list(recipe.thumbnails.values())
+    if recipe.image:
+        names.insert(0, recipe.image.name)
+    return names
+
+
+def acquire(names):
+    """Добавляет по ссылке на каждый файл из names. Вызывается
+    в транзакции до записи файлов: блокировка строки не дает удалить
+    файл, пока транзакция не завершится.
+    """
+    for name, count in Counter(names).items():
+        if MediaBlob.objects.filter(name=name).update(
+                refs=F('refs') + count):
+            continue
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.create(name=name, refs=count)
+        except IntegrityError:
+            MediaBlob.objects.filter(name=name).update(
+                refs=F('refs') + count)
+
+
+def release(names):
+    """Снимает ссылки, файлы без ссылок удаляются после коммита."""
+    counts = Counter(names)
+    for name, count in counts.items():
+        MediaBlob.objects.filter(name=name).update(
+            refs=Greatest(F('refs') - count, 0))
+    delete_files(list(counts))
+
+
+def delete_orphans(names):
+    """Удаляет файлы и строки с нулем ссылок. Строки блокируются:
+    acquire в другой транзакции дождется удаления и создаст строку
+    заново, а файл запишет уже после этого.
+    """
+    with transaction.atomic():
+        orphans = list(MediaBlob.objects.select_for_update().filter(
+            name__in=names, refs=0).values_list('name', flat=True))
+        for name in orphans:
+            storage.delete(name)
+        MediaBlob.objects.filter(name__in=orphans).delete()
+
+
+def delete_files(names):
+    """После коммита удаляет файлы, на которые к этому моменту
+    не осталось ссылок."""
+    if names:
+        transaction.on_commit(lambda: delete_orphans(names))
+
+
+def get_live_refs():
+    """Считает ссылки по рецептам: {имя файла: число ссылок}."""
+    refs = Counter()
+    for image, thumbnails in Recipe.objects.values_list(
+            'image', 'thumbnails').iterator():
+        if image:
+            refs[image] += 1
+        refs.update(thumbnails.values())
+    return refs
+
+
+@transaction.atomic
+def reconcile_refs():
+    """Пересчитывает таблицу ссылок, файлы без ссылок удаляет."""
+    live = get_live_refs()
+    stored = dict(MediaBlob.objects.values_list('name', 'refs'))
+    orphans = [name for name in stored if name not in live]
+    MediaBlob.objects.filter(name__in=orphans).update(refs=0)
+    delete_files(orphans)
+    for name, refs in live.items():
+        if name in stored and stored[name] != refs:
+            MediaBlob.objects.filter(name=name).update(refs=refs)
+    MediaBlob.objects.bulk_create(
+        MediaBlob(name=name, refs=refs)
+        for name, refs in live.items() if name not in stored)
+
+
+def verify_refs():
+    """Возвращает расхождения: {имя файла: (в таблице, по рецептам)}.
+    Строки с нулем ссылок ждут удаления после коммита и не считаются.
+    """
+    live = get_live_refs()
+    stored = dict(MediaBlob.objects.filter(
+        refs__gt=0).values_list('name', 'refs'))
+    return {
+        name: (stored.get(name), live.get(name))
+        for name in stored.keys() | live.keys()
+        if stored.get(name) != live.get(name)}
+
+
+def get_legacy_names():
+    """Картинки рецептов, сохраненные не по хэшу содержимого."""
+    return sorted(
+        name for name in Recipe.objects.exclude(image='').exclude(
+            image=None).values_list('image', flat=True).distinct()
+        if not storage.is_addressed(name))
+
+
+@transaction.atomic
+def dedupe_files():
+    """Переносит картинки со старыми именами в хранилище по хэшу:
+    одинаковые файлы становятся одним. Возвращает {старое имя: новое}.
+    Ключи тел рецептов включают имя картинки из БД, поэтому прежние
+    адреса перестают отдавать все воркеры, а не только этот процесс.
+    """
+    moved, recipe_ids = {}, []
+    for name in get_legacy_names():
+        if not storage.exists(name):
+            continue
+        recipes = Recipe.objects.filter(image=name)
+        ids = list(recipes.values_list('id', flat=True))
+        target = image_field.generate_filename(None, os.path.basename(name))
+        with storage.open(name) as file:
+            acquire([storage.get_content_name(target, file)] * len(ids))
+            moved[name] = storage.save(target, file)
+        recipes.update(image=moved[name])
+        recipe_ids.extend(ids)
+    if recipe_ids:
+        versions.bump_row_versions('recipe', recipe_ids)
+        versions.bump_version('recipe')
+    transaction.on_commit(
+        lambda: [storage.delete(name) for name in moved])
+    return moved
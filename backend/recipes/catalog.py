@@ -0,0 +1,190 @@
+"""Каталоги ингредиентов и тегов в памяти процесса.
+Ингредиенты и теги почти не меняются, поэтому список, поиск и проверка
+id и slug обслуживаются без чтения самих таблиц. Версия каталога
+хранится в БД (CatalogVersion): сохранение ингредиента или тега и
+загрузка командами download_ingrs/download_tags меняют версию, и каждый
+воркер перечитывает каталог при следующем обращении. Версия читается
+из БД не чаще раза за HTTP-запрос.
+"""
+import bisect
+import threading
+
+from django.core.signals import request_finished, request_started
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from core import versions
+from recipes.models import CatalogVersion, Ingredient, Tag
+
+TABLE = 'ingredient'
+TAG_TABLE = 'tag'
+
+local = threading.local()
+
+
+def start_request(**kwargs):
+    local.versions = {}
+
+
+def finish_request(**kwargs):
+    local.versions = None
+
+
+request_started.connect(start_request)
+request_finished.connect(finish_request)
+
+
+def read_version(table):
+    """Версия каталога, в пределах запроса - прочитанная первой."""
+    checked = getattr(local, 'versions', None)
+    if checked is not None and table in checked:
+        return checked[table]
+    version = CatalogVersion.objects.filter(
+        name=table).values_list('version', flat=True).first() or 0
+    if checked is not None:
+        checked[table] = version
+    return version
+
+
+def change_version(table):
+    """Сдвигает версию каталога для всех процессов."""
+    stamp = versions.now()
+    updated = CatalogVersion.objects.filter(name=table).update(
+        version=Greatest(F('version') + 1, stamp))
+    if not updated:
+        try:
+            with transaction.atomic():
+                CatalogVersion.objects.create(name=table, version=stamp)
+        except IntegrityError:
+            CatalogVersion.objects.filter(name=table).update(
+                version=Greatest(F('version') + 1, stamp))
+    checked = getattr(local, 'versions', None)
+    if checked is not None:
+        checked.pop(table, None)
+
+
+def get_version():
+    return read_version(TABLE)
+
+
+def get_tag_version():
+    return read_version(TAG_TABLE)
+
+
+def bump_version():
+    change_version(TABLE)
+
+
+def bump_tag_version():
+    change_version(TAG_TABLE)
+
+
+class IngredientCatalog:
+    """Ингредиенты, проиндексированные по id и по названию в нижнем
+    регистре. Префиксный поиск идет бинарным поиском по отсортированным
+    названиям.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._by_id = {}
+        self._names = []
+        self._ingredients = []
+
+    def _refresh(self):
+        version = get_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            ingredients = sorted(
+                Ingredient.objects.all(),
+                key=lambda item: (item.name.lower(), item.id))
+            self._by_id = {
+                ingredient.id: ingredient for ingredient in ingredients}
+            self._names = [
+                ingredient.name.lower() for ingredient in ingredients]
+            self._ingredients = ingredients
+            self._version = version
+
+    def all(self):
+        self._refresh()
+        return self._ingredients
+
+    def get(self, pk):
+        self._refresh()
+        try:
+            return self._by_id.get(int(pk))
+        except (TypeError, ValueError):
+            return None
+
+    def get_many(self, ids):
+        """Возвращает найденные ингредиенты по id: {id: ingredient}."""
+        self._refresh()
+        return {
+            pk: self._by_id[pk] for pk in ids if pk in self._by_id}
+
+    def search(self, value, limit=None):
+        """Сначала совпадения с начала названия, затем вхождения."""
+        self._refresh()
+        value = value.lower()
+        names, ingredients = self._names, self._ingredients
+        start = bisect.bisect_left(names, value)
+        end = start
+        while end < len(names) and names[end].startswith(value):
+            end += 1
+        result = ingredients[start:end]
+        if limit is None or len(result) < limit:
+            result += [
+                ingredient
+                for index, (name, ingredient)
+                in enumerate(zip(names, ingredients))
+                if value in name and not start <= index < end]
+        return result[:limit]
+
+
+class TagCatalog:
+    """Теги по slug и id: варианты фильтра tags, перевод slug в id
+    и дата публикации для условных GET."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._by_slug = {}
+        self._by_id = {}
+
+    def _refresh(self):
+        version = get_tag_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._by_slug = {
+                tag.slug: tag for tag in Tag.objects.order_by('slug')}
+            self._by_id = {tag.id: tag for tag in self._by_slug.values()}
+            self._version = version
+
+    def choices(self):
+        self._refresh()
+        return [(slug, tag.name) for slug, tag in self._by_slug.items()]
+
+    def get(self, pk):
+        self._refresh()
+        try:
+            return self._by_id.get(int(pk))
+        except (TypeError, ValueError):
+            return None
+
+    def get_ids(self, slugs):
+        self._refresh()
+        return [
+            self._by_slug[slug].id
+            for slug in slugs if slug in self._by_slug]
+
+
+ingredient_catalog = IngredientCatalog()
+tag_catalog = TagCatalog()
@@ -0,0 +1,68 @@
+"""Счетчики избранного и корзин в таблице рецептов.
+Recipe.favorites_count и Recipe.in_carts_count меняются одним
+UPDATE ... SET n = n + k при изменении связей FavoriteRecipe.recipe и
+ShoppingCart.recipe (сигналы в api.signals), поэтому для вывода и
+сортировки по популярности ничего не нужно пересчитывать.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from core import versions
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+
+COUNTERS = {
+    FavoriteRecipe.recipe.through: 'favorites_count',
+    ShoppingCart.recipe.through: 'in_carts_count',
+}
+# Счетчики таблиц связей: по ним сбрасывается кэш ответов для анонимов.
+TABLES = ('favorite', 'shopping_cart')
+
+
+def change_counter(field, recipe_ids, delta):
+    """Меняет счетчик одним UPDATE и сбрасывает закэшированные тела
+    рецептов: счетчики выводятся в них.
+    """
+    if not delta:
+        return
+    recipe_ids = list(recipe_ids)
+    Recipe.objects.filter(id__in=recipe_ids).update(
+        **{field: Greatest(F(field) + delta, 0)})
+    versions.bump_row_versions('recipe', recipe_ids)
+
+
+def get_live_counts():
+    """Выражения для подсчета связей каждого рецепта по through-таблицам."""
+    return {
+        field: Coalesce(Subquery(
+            through.objects.filter(
+                recipe=OuterRef('id')
+            ).order_by().values('recipe').annotate(
+                count=Count('id')).values('count')), 0)
+        for through, field in COUNTERS.items()}
+
+
+@transaction.atomic
+def reconcile_counters():
+    """Пересчитывает все счетчики одним UPDATE и сдвигает версии тел
+    рецептов и таблиц связей, чтобы кэш ответов тоже обновился.
+    """
+    Recipe.objects.update(**get_live_counts())
+    versions.bump_row_versions(
+        'recipe', Recipe.objects.values_list('id', flat=True))
+    versions.bump_versions(TABLES)
+
+
+def verify_counters():
+    """Возвращает расхождения: {(recipe_id, поле): (в таблице, по связям)}."""
+    live = {
+        f'live_{field}': count
+        for field, count in get_live_counts().items()}
+    mismatches = {}
+    for row in Recipe.objects.annotate(**live).values(
+            'id', *COUNTERS.values(), *live).iterator():
+        for field in COUNTERS.values():
+            if row[field] != row[f'live_{field}']:
+                mismatches[(row['id'], field)] = (
+                    row[field], row[f'live_{field}'])
+    return mismatches
@@ -0,0 +1,190 @@
+"""Обработка картинок рецептов.
+В запросе base64 декодируется, читается заголовок картинки, и исходный
+файл сразу сохраняется в рецепт: картинка не теряется, даже если
+фоновая обработка не состоится. Полное декодирование, поворот по EXIF,
+удаление метаданных, уменьшение до IMAGE_MAX_SIZE и миниатюры шириной
+IMAGE_THUMBNAIL_WIDTHS делаются после коммита в фоновом пуле потоков
+и заменяют исходный файл; при ошибке рецепт остается с исходным.
+Файлы сохраняются в хранилище по хэшу содержимого, ссылки на них
+считает recipes.blobs.
+"""
+import base64
+import binascii
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from recipes import blobs
+from recipes.models import Recipe
+
+FORMAT = 'JPEG'
+EXTENSION = 'jpg'
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_PIPELINE_WORKERS)
+
+
+def decode(payload):
+    """Декодирует data URI или чистый base64 и проверяет заголовок
+    картинки, не декодируя пиксели. Ошибки - ValueError.
+    """
+    if ';base64,' in payload:
+        payload = payload.split(';base64,', 1)[1]
+    if len(payload) * 3 // 4 > settings.IMAGE_MAX_UPLOAD_SIZE:
+        raise ValueError('Слишком большой файл.')
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError('Некорректный base64.')
+    read_header(data)
+    return data
+
+
+def read_header(data):
+    """Возвращает формат и размеры (ширина, высота) по заголовку."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format, (width, height) = image.format, image.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError('Загрузите корректное изображение.')
+    if image_format not in EXTENSIONS:
+        raise ValueError(f'Неподдерживаемый формат: {image_format}.')
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValueError('Слишком большое разрешение.')
+    return image_format, (width, height)
+
+
+def flatten(image):
+    """Переводит в RGB, заливая прозрачные области белым."""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode(image):
+    """JPEG без EXIF и ICC: сохраняются только пиксели."""
+    buffer = io.BytesIO()
+    image.save(
+        buffer, FORMAT,
+        quality=settings.IMAGE_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def get_name(content, extension=EXTENSION):
+    """Имя файла в хранилище по хэшу содержимого, без записи."""
+    return blobs.storage.get_content_name(
+        blobs.image_field.generate_filename(None, f'image.{extension}'),
+        ContentFile(content))
+
+
+def store(content, extension=EXTENSION):
+    return blobs.storage.save(
+        blobs.image_field.generate_filename(None, f'image.{extension}'),
+        ContentFile(content))
+
+
+def process(data):
+    """Возвращает содержимое основного файла, его размеры (ширина,
+    высота) и миниатюры {ширина: содержимое}.
+    Миниатюры шире уменьшенной картинки не создаются.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = flatten(ImageOps.exif_transpose(source))
+    bound = settings.IMAGE_MAX_SIZE
+    image.thumbnail((bound, bound), Image.LANCZOS)
+    thumbnails = {}
+    for width in settings.IMAGE_THUMBNAIL_WIDTHS:
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        thumbnails[str(width)] = encode(
+            image.resize((width, height), Image.LANCZOS))
+    return encode(image), image.size, thumbnails
+
+
+def replace_files(recipe, image, size, thumbnails, files):
+    """Записывает в рецепт картинку, ее размеры и миниатюры. Ссылки
+    на новые файлы добавляются до их записи в той же транзакции,
+    на прежние снимаются. files - [(содержимое, расширение)].
+    """
+    previous = blobs.get_names(recipe)
+    recipe.image = image
+    recipe.image_width, recipe.image_height = size
+    recipe.thumbnails = thumbnails
+    blobs.acquire(blobs.get_names(recipe))
+    for content, extension in files:
+        store(content, extension)
+    recipe.save(update_fields=(
+        'image', 'image_width', 'image_height', 'thumbnails'))
+    blobs.release(previous)
+
+
+def attach(recipe, data):
+    """Сохраняет исходную картинку в рецепт в текущей транзакции
+    и ставит ее обработку после коммита. До обработки выводится
+    исходный файл без миниатюр.
+    """
+    image_format, size = read_header(data)
+    extension = EXTENSIONS[image_format]
+    name = get_name(data, extension)
+    replace_files(recipe, name, size, {}, [(data, extension)])
+    schedule(recipe.id, name)
+
+
+def apply(recipe_id, original):
+    """Обрабатывает исходный файл и заменяет его в рецепте, если за это
+    время картинку не сменили. При ошибке рецепт остается с исходным
+    файлом. Сохранение рецепта сбрасывает кэши его представления
+    через сигналы.
+    """
+    try:
+        with blobs.storage.open(original) as file:
+            content, size, thumbnails = process(file.read())
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.exception('Не удалось обработать картинку рецепта %s.',
+                         recipe_id)
+        return
+    files = [(content, EXTENSION)]
+    files.extend((thumbnail, EXTENSION) for thumbnail in thumbnails.values())
+    with transaction.atomic():
+        recipe = Recipe.objects.select_for_update().filter(
+            id=recipe_id, image=original).first()
+        if recipe is not None:
+            replace_files(
+                recipe, get_name(content), size,
+                {width: get_name(thumbnail)
+                 for width, thumbnail in thumbnails.items()},
+                files)
+
+
+def apply_in_background(recipe_id, original):
+    try:
+        apply(recipe_id, original)
+    finally:
+        connections.close_all()
+
+
+def schedule(recipe_id, original):
+    """Ставит обработку сохраненного исходного файла после коммита.
+    Если к моменту записи у рецепта другая картинка, результат
+    отбрасывается.
+    """
+
+    def submit():
+        if settings.IMAGE_PIPELINE_ASYNC:
+            executor.submit(apply_in_background, recipe_id, original)
+        else:
+            apply(recipe_id, original)
+
+    transaction.on_commit(submit)
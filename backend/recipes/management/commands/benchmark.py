@@ -0,0 +1,46 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_databases,
+                               setup_test_environment, teardown_databases,
+                               teardown_test_environment)
+from recipes.benchmark import (BUDGETS_PATH, check_budgets, load_budgets,
+                               load_dataset, run_benchmark)
+
+# Свой кэш процесса: холодные замеры очищают его, общий кэш воркеров
+# и счетчики изменений рабочей БД стенд не трогает.
+BENCHMARK_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'benchmark',
+    'OPTIONS': {'MAX_ENTRIES': 100000},
+}}
+
+
+class Command(BaseCommand):
+    help = 'Замер производительности API на синтетических данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--budgets', default=BUDGETS_PATH)
+
+    def handle(self, *args, **options):
+        budgets = load_budgets(options['budgets'])
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                self.stdout.write(
+                    f'База данных: {connection.vendor}. Загрузка данных...')
+                reader = load_dataset(
+                    users=options['users'], recipes=options['recipes'])
+                results = run_benchmark(
+                    reader, repeat=options['repeat'], stdout=self.stdout)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+        errors = check_budgets(results, budgets)
+        if errors:
+            raise CommandError(
+                'Превышены бюджеты:\n' + '\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Бюджеты соблюдены'))
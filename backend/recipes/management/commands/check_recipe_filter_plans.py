@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from recipes.models import Recipe, Tag
+from recipes.plans import check_filter_plans
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Проверка по EXPLAIN, что каждая комбинация фильтров '
+            'списка рецептов использует индексы')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Выводить планы всех комбинаций')
+
+    def handle(self, *args, **options):
+        recipe = Recipe.objects.only('author').order_by('id').first()
+        user = User.objects.order_by('id').first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        if recipe is None or not tags:
+            raise CommandError('Нужны хотя бы один рецепт и тег')
+        results = check_filter_plans(user, recipe.author_id, tags)
+        failed = 0
+        for combination, (lines, problems) in results.items():
+            name = ' + '.join(combination) or 'без фильтров'
+            if problems:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{name}: без индекса'))
+            elif options['verbose_plans']:
+                self.stdout.write(f'{name}: индексы')
+            if problems or options['verbose_plans']:
+                for line in lines:
+                    self.stdout.write(f'    {line}')
+        if failed:
+            raise CommandError(f'Комбинаций без индекса: {failed}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Все комбинации ({len(results)}) используют индексы'))
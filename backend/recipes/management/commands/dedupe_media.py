@@ -0,0 +1,34 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.blobs import (dedupe_files, get_legacy_names, reconcile_refs,
+                           verify_refs)
+
+
+class Command(BaseCommand):
+    help = ('Перенос картинок рецептов в хранилище по хэшу содержимого '
+            'и пересчет ссылок на файлы')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help='Только найти файлы со старыми именами и сверить ссылки')
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            moved = dedupe_files()
+            self.stdout.write(
+                f'Перенесено файлов: {len(moved)}, '
+                f'осталось различных: {len(set(moved.values()))}')
+            reconcile_refs()
+            self.stdout.write('Ссылки на файлы пересчитаны')
+        legacy = get_legacy_names()
+        for name in legacy:
+            self.stdout.write(f'Файл не по хэшу: {name}')
+        mismatches = verify_refs()
+        for name, (stored, live) in sorted(mismatches.items()):
+            self.stdout.write(
+                f'Файл {name}: в таблице {stored}, по рецептам {live}')
+        if legacy or mismatches:
+            raise CommandError(
+                f'Расхождений: {len(legacy) + len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -2,6 +2,7 @@ import csv
 
 from django.conf import settings
 from django.core.management import BaseCommand
+from recipes.catalog import bump_version
 from recipes.models import Ingredient
 
 
@@ -18,4 +19,5 @@ class Command(BaseCommand):
             reader = csv.DictReader(file)
             Ingredient.objects.bulk_create(
                 Ingredient(**data) for data in reader)
+        bump_version()
         self.stdout.write(self.style.SUCCESS('Ингридиенты загружены'))
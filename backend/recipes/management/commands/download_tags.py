@@ -1,4 +1,5 @@
 from django.core.management import BaseCommand
+from recipes.catalog import bump_tag_version
 from recipes.models import Tag
 
 
@@ -11,4 +12,5 @@ class Command(BaseCommand):
             {'name': 'Обед', 'color': '#49B64E', 'slug': 'dinner'},
             {'name': 'Ужин', 'color': '#8775D2', 'slug': 'supper'}]
         Tag.objects.bulk_create(Tag(**tag) for tag in data)
+        bump_tag_version()
         self.stdout.write(self.style.SUCCESS('Теги загружены'))
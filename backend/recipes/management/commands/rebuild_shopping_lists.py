@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.shopping_totals import rebuild_totals, verify_totals
+
+
+class Command(BaseCommand):
+    help = 'Пересборка и сверка сводных списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help='Только сверить таблицу с корзинами, не пересобирая')
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            rebuild_totals()
+            self.stdout.write('Списки покупок пересобраны')
+        mismatches = verify_totals()
+        if mismatches:
+            for (user_id, ingredient_id), (stored, live) in sorted(
+                    mismatches.items()):
+                self.stdout.write(
+                    f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                    f'в таблице {stored}, по рецептам {live}')
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.counters import reconcile_counters, verify_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчет и сверка счетчиков избранного и корзин у рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help='Только сверить счетчики со связями, не пересчитывая')
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            reconcile_counters()
+            self.stdout.write('Счетчики рецептов пересчитаны')
+        mismatches = verify_counters()
+        if mismatches:
+            for (recipe_id, field), (stored, live) in sorted(
+                    mismatches.items()):
+                self.stdout.write(
+                    f'Рецепт {recipe_id}, {field}: '
+                    f'в таблице {stored}, по связям {live}')
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:03
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_recipe_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    counters = {
+        'favorites_count': apps.get_model(
+            'recipes', 'FavoriteRecipe').recipe.through,
+        'in_carts_count': apps.get_model(
+            'recipes', 'ShoppingCart').recipe.through,
+    }
+    Recipe.objects.update(**{
+        field: Coalesce(Subquery(
+            through.objects.filter(
+                recipe=OuterRef('id')
+            ).order_by().values('recipe').annotate(
+                count=Count('id')).values('count')), 0)
+        for field, through in counters.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(
+            fill_recipe_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:07
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from PIL import Image
+
+
+def fill_image_dimensions(apps, schema_editor):
+    """Читает размеры из заголовков уже загруженных картинок."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    recipes = Recipe.objects.exclude(image='').exclude(image=None)
+    for recipe in recipes.only('id', 'image').iterator():
+        try:
+            with default_storage.open(recipe.image.name) as file:
+                width, height = Image.open(file).size
+        except (OSError, ValueError):
+            continue
+        Recipe.objects.filter(id=recipe.id).update(
+            image_width=width, image_height=height)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_height',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_width',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.RunPython(
+            fill_image_dimensions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:11
+
+import core.search
+from django.db import migrations
+
+INGREDIENT_NAMES = (
+    "(SELECT {aggregate} FROM recipes_recipeingredient ri "
+    "JOIN recipes_ingredient i ON i.id = ri.ingredient_id "
+    "WHERE ri.recipe_id = r.id)")
+POSTGRESQL_INDEX = [
+    "UPDATE recipes_recipe r SET search_vector = "
+    "setweight(to_tsvector('russian', coalesce(r.name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(r.text, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce("
+    + INGREDIENT_NAMES.format(aggregate="string_agg(i.name, ' ')")
+    + ", '')), 'C')",
+    "CREATE INDEX recipe_search_vector_idx ON recipes_recipe "
+    "USING gin (search_vector)",
+]
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5("
+    "name, text, ingredients, tokenize='unicode61 remove_diacritics 2')",
+    "INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients) "
+    "SELECT r.id, r.name, r.text, coalesce("
+    + INGREDIENT_NAMES.format(aggregate="group_concat(i.name, ' ')")
+    + ", '') FROM recipes_recipe r",
+]
+
+
+def has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+def create_search_index(apps, schema_editor):
+    """GIN-индекс на PostgreSQL, таблица FTS5 на SQLite."""
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        statements = POSTGRESQL_INDEX
+    elif connection.vendor == 'sqlite' and has_fts5(connection):
+        statements = SQLITE_INDEX
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=core.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый индекс'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
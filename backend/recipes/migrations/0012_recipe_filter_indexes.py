@@ -0,0 +1,38 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+THROUGH_INDEXES = (
+    ('recipe_tags_tag_recipe_idx', 'recipes_recipe_tags',
+     'tag_id, recipe_id'),
+    ('favorite_recipe_owner_idx', 'recipes_favoriterecipe_recipe',
+     'recipe_id, favoriterecipe_id'),
+    ('cart_recipe_owner_idx', 'recipes_shoppingcart_recipe',
+     'recipe_id, shoppingcart_id'),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_search'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_pub_date_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id', 'author'], name='recipe_pub_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe_author_pub_date_idx'),
+        ),
+        *(migrations.RunSQL(
+            f'CREATE INDEX {name} ON {table} ({columns})',
+            f'DROP INDEX {name}')
+          for name, table, columns in THROUGH_INDEXES),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:40
+
+from collections import Counter
+
+from django.db import migrations
+
+
+def backfill_media_blobs(apps, schema_editor):
+    """Заводит ссылки на картинки и миниатюры, загруженные до появления
+    таблицы файлов: иначе удаление рецепта не находит их и файл
+    остается, а одинаковый файл другого рецепта удаляется раньше срока.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    MediaBlob = apps.get_model('recipes', 'MediaBlob')
+    refs = Counter()
+    for image, thumbnails in Recipe.objects.values_list(
+            'image', 'thumbnails').iterator():
+        if image:
+            refs[image] += 1
+        refs.update((thumbnails or {}).values())
+    stored = dict(MediaBlob.objects.values_list('name', 'refs'))
+    for name, count in refs.items():
+        if name in stored and stored[name] != count:
+            MediaBlob.objects.filter(name=name).update(refs=count)
+    MediaBlob.objects.bulk_create(
+        (MediaBlob(name=name, refs=count)
+         for name, count in refs.items() if name not in stored),
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_media_blobs, migrations.RunPython.noop),
+    ]
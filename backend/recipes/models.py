@@ -1,8 +1,13 @@
 from core.models import CreatedModel
+from core.prefetch import prefetch_top
+from core.search import SearchVectorField
+from core.storage import ContentAddressedStorage
 from core.validators import validate_min
 from django.contrib.auth import get_user_model
 from django.core import validators
 from django.db import models
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce, Lower
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
@@ -51,11 +56,27 @@ class Ingredient(CreatedModel):
     class Meta:
         verbose_name = 'Ингридиент'
         verbose_name_plural = 'Ингридиенты'
+        indexes = [
+            models.Index(Lower('name'), name='ingredient_name_lower_idx')]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def prefetch_for_read(self):
+        """Подгружает связи, которые выводит RecipeReadSerializer:
+        теги и ингредиенты рецепта вместе с самими ингредиентами.
+        """
+        return self.prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')))
+
+
 class Recipe(CreatedModel):
     author = models.ForeignKey(
         User,
@@ -70,10 +91,31 @@ class Recipe(CreatedModel):
     )
     image = models.ImageField(
         verbose_name='Ссылка на картинку на сайте',
-        upload_to='static/recipe/',
+        upload_to='recipes/',
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True
     )
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина картинки',
+        null=True,
+        editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        verbose_name='Высота картинки',
+        null=True,
+        editable=False
+    )
+    thumbnails = models.JSONField(
+        verbose_name='Миниатюры картинки',
+        default=dict,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый индекс',
+        null=True,
+        editable=False
+    )
     text = models.TextField(
         verbose_name='Описание'
     )
@@ -93,15 +135,70 @@ class Recipe(CreatedModel):
             1, message='Мин. время приготовления 1 минута'), ]
     )
 
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В корзинах',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', )
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id', 'author'),
+                name='recipe_pub_date_id_idx'),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_pub_date_idx'),
+            models.Index(
+                fields=('-favorites_count', '-pub_date', '-id'),
+                name='recipe_favorites_count_idx')]
 
     def __str__(self):
         return self.name
 
 
+class SubscribeQuerySet(models.QuerySet):
+
+    def with_author_stats(self):
+        """Автор одним JOIN, число его рецептов подзапросом и флаг
+        подписки: подписки читателя всегда отмечены как активные.
+        """
+        recipes_count = Recipe.objects.filter(
+            author=OuterRef('author')
+        ).order_by().values('author').annotate(
+            count=Count('id')).values('count')
+        return self.select_related('author').annotate(
+            recipes_count=Coalesce(Subquery(recipes_count), 0),
+            is_subscribed=Value(True))
+
+
+def prefetch_subscription_recipes(subscriptions, limit):
+    """Подгружает авторам подписок не более limit последних рецептов
+    в author.top_recipes одним запросом с ROW_NUMBER(): страница
+    подписок читается тремя запросами независимо от числа авторов.
+    """
+    prefetch_top(
+        [subscribe.author for subscribe in subscriptions],
+        Recipe.objects.only(
+            'id', 'author', 'name', 'image', 'image_width',
+            'image_height', 'thumbnails', 'cooking_time', 'pub_date'),
+        group_by='author',
+        ordering=('-pub_date', '-id'),
+        limit=limit,
+        to_attr='top_recipes')
+    return subscriptions
+
+
 class Subscribe(CreatedModel):
     user = models.ForeignKey(
         User,
@@ -119,10 +216,16 @@ class Subscribe(CreatedModel):
         'Дата подписки',
         auto_now_add=True)
 
+    objects = SubscribeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
         unique_together = ['user', 'author']
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-id'),
+                name='subscribe_user_pub_date_idx')]
 
 
 class ShoppingCart(CreatedModel):
@@ -207,3 +310,70 @@ class RecipeIngredient(CreatedModel):
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
                 name='unique ingredient')]
+
+
+class ShoppingCartIngredient(CreatedModel):
+    """Сводное количество ингредиента в корзине пользователя.
+    Обновляется при изменении корзины и состава рецептов в ней.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='shopping_cart_totals',
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique shopping cart ingredient')]
+
+
+class MediaBlob(models.Model):
+    """Файл в хранилище по хэшу и число ссылок на него из рецептов
+    (картинка и миниатюры). Файл удаляется, когда ссылок не остается.
+    """
+
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Имя файла')
+    refs = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число ссылок')
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+
+class CatalogVersion(models.Model):
+    """Версия каталога в памяти процесса (ингредиенты, теги).
+    Хранится в БД, поэтому изменение из любого воркера или команды
+    видят все процессы. Значение - время последнего изменения
+    в микросекундах.
+    """
+
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name='Каталог')
+    version = models.BigIntegerField(
+        default=0,
+        verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версии каталогов'
@@ -0,0 +1,84 @@
+"""Проверка планов запросов списка рецептов по EXPLAIN.
+Для каждой комбинации фильтров RecipeFilter (author, tags, is_favorited,
+is_in_shopping_cart) строится тот же запрос первой страницы, что и во
+вьюсете, и проверяется его план:
+- PostgreSQL: EXPLAIN (FORMAT JSON) при enable_seqscan = off. Планировщик
+  выбирает Seq Scan только тогда, когда подходящего индекса нет, поэтому
+  любой Seq Scan в плане - ошибка;
+- SQLite: EXPLAIN QUERY PLAN, ошибкой считается шаг SCAN без индекса.
+  Проход по индексу в порядке сортировки (SCAN ... USING INDEX) для
+  первой страницы с LIMIT допустим.
+"""
+import itertools
+import re
+from types import SimpleNamespace
+
+from django.db import connections, transaction
+
+from core.filters import RecipeFilter
+from recipes.models import Recipe
+
+FILTERS = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+PAGE_SIZE = 6
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?\w+$')
+
+
+def get_combinations():
+    return [
+        combination
+        for size in range(len(FILTERS) + 1)
+        for combination in itertools.combinations(FILTERS, size)]
+
+
+def get_queryset(combination, user, author_id, tags):
+    values = {
+        'author': author_id,
+        'tags': tags,
+        'is_favorited': '1',
+        'is_in_shopping_cart': '1',
+    }
+    data = {name: values[name] for name in combination}
+    filterset = RecipeFilter(
+        data,
+        queryset=Recipe.objects.only('id', 'author', 'pub_date', 'image'),
+        request=SimpleNamespace(user=user))
+    if not filterset.is_valid():
+        raise ValueError(dict(filterset.errors))
+    return filterset.qs[:PAGE_SIZE]
+
+
+def walk(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from walk(child)
+
+
+def explain(queryset):
+    """Возвращает строки плана и шаги без индекса."""
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(using=queryset.db), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            nodes = list(walk(cursor.fetchone()[0][0]['Plan']))
+            lines = [
+                ' '.join(filter(None, (
+                    node['Node Type'], node.get('Index Name'),
+                    node.get('Relation Name'))))
+                for node in nodes]
+            problems = [
+                line for node, line in zip(nodes, lines)
+                if node['Node Type'] == 'Seq Scan']
+            return lines, problems
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        lines = [row[-1] for row in cursor.fetchall()]
+    return lines, [line for line in lines if SQLITE_FULL_SCAN.match(line)]
+
+
+def check_filter_plans(user, author_id, tags):
+    """{комбинация фильтров: (строки плана, шаги без индекса)}."""
+    return {
+        combination: explain(
+            get_queryset(combination, user, author_id, tags))
+        for combination in get_combinations()}
@@ -0,0 +1,158 @@
+"""Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+На PostgreSQL текст хранится в колонке Recipe.search_vector
+(tsvector, русская морфология, GIN-индекс), результаты ранжируются
+ts_rank. На SQLite используется таблица FTS5 с ранжированием bm25,
+слова запроса ищутся по префиксу вместо стемминга. Индекс обновляется
+после коммита при изменении рецепта, его состава и названий
+ингредиентов, каждый рецепт - один раз за транзакцию.
+Ранжированная выдача сортируется по релевантности, поэтому курсорная
+пагинация по дате к ней не применяется (core.pagination отвечает 400).
+"""
+import functools
+import re
+import threading
+
+from django.db import connections, router, transaction
+from django.db.models import F, Func, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe, RecipeIngredient
+
+CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+WEIGHTS = {'name': 'A', 'text': 'B', 'ingredients': 'C'}
+BM25_WEIGHTS = '10.0, 4.0, 2.0'
+
+local = threading.local()
+
+
+class JoinNames(Func):
+    """Названия через пробел: STRING_AGG на PostgreSQL,
+    GROUP_CONCAT на SQLite."""
+
+    function = 'STRING_AGG'
+    output_field = TextField()
+
+    def __init__(self, expression):
+        super().__init__(expression, Value(' '))
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection, function='GROUP_CONCAT', **extra_context)
+
+
+def get_ingredient_names():
+    return Subquery(
+        RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=JoinNames(F('ingredient__name'))).values('names'),
+        output_field=TextField())
+
+
+def get_connection():
+    return connections[router.db_for_write(Recipe)]
+
+
+@functools.lru_cache()
+def has_fts_table(alias):
+    return FTS_TABLE in connections[alias].introspection.table_names()
+
+
+def use_fts(connection):
+    return connection.vendor == 'sqlite' and has_fts_table(connection.alias)
+
+
+def update_search_index(recipe_ids):
+    """Пересчитывает поисковый индекс рецептов recipe_ids,
+    recipe_ids может быть подзапросом."""
+    connection = get_connection()
+    recipes = Recipe.objects.using(connection.alias).filter(id__in=recipe_ids)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+        sources = {
+            'name': F('name'), 'text': F('text'),
+            'ingredients': get_ingredient_names()}
+        vector = None
+        for field, weight in WEIGHTS.items():
+            part = SearchVector(sources[field], weight=weight, config=CONFIG)
+            vector = part if vector is None else vector + part
+        recipes.update(search_vector=vector)
+    elif use_fts(connection):
+        rows = list(recipes.annotate(
+            ingredient_names=get_ingredient_names()
+        ).values_list('id', 'name', 'text', 'ingredient_names'))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} '
+                f'(rowid, name, text, ingredients) VALUES (%s, %s, %s, %s)',
+                [(*row[:3], row[3] or '') for row in rows])
+
+
+def schedule_update(recipe_ids):
+    """Откладывает пересчет индекса до коммита. Рецепты копятся в одном
+    множестве, первый сработавший после коммита обработчик пересчитывает
+    их все, остальные ничего не делают.
+    """
+    pending = getattr(local, 'pending', None)
+    if pending is None:
+        pending = local.pending = set()
+    pending.update(recipe_ids)
+    transaction.on_commit(flush_updates, using=get_connection().alias)
+
+
+def flush_updates():
+    recipe_ids = getattr(local, 'pending', None)
+    local.pending = set()
+    if recipe_ids:
+        update_search_index(sorted(recipe_ids))
+
+
+def remove_from_search_index(recipe_ids):
+    """Колонка PostgreSQL удаляется вместе со строкой рецепта,
+    строки FTS5 удаляются отдельно."""
+    connection = get_connection()
+    if use_fts(connection):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(recipe_id,) for recipe_id in recipe_ids])
+
+
+def get_fts_query(value):
+    """Слова запроса как префиксы, все обязательны: "борщ"*."""
+    return ' '.join(
+        f'"{word}"*' for word in re.findall(r'\w+', value.lower()))
+
+
+def search(queryset, value):
+    """Рецепты, подходящие под запрос, от более релевантных к менее,
+    при равной релевантности - от новых к старым."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        query = SearchQuery(value, config=CONFIG, search_type='websearch')
+        return queryset.filter(search_vector__matches=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-pub_date', '-id')
+    if use_fts(connection):
+        match = get_fts_query(value)
+        if not match:
+            return queryset.none()
+        table = Recipe._meta.db_table
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,))
+        ).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {BM25_WEIGHTS}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            (match,))
+        ).order_by('-search_rank', '-pub_date', '-id')
+    return queryset.filter(
+        Q(name__icontains=value) | Q(text__icontains=value)
+        | Q(id__in=RecipeIngredient.objects.filter(
+            ingredient__name__icontains=value).values('recipe'))
+    ).order_by('-pub_date', '-id')
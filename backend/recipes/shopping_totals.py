@@ -0,0 +1,110 @@
+"""Сводные количества ингредиентов в корзинах (ShoppingCartIngredient).
+Меняются при изменении корзины и состава рецептов в ней: сигналы
+в api.signals, сериализатор рецепта и админка. Команда
+rebuild_shopping_lists пересобирает и сверяет таблицу.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.aggregates import Sum
+from django.db.models.functions import Greatest
+
+from recipes.models import RecipeIngredient, ShoppingCartIngredient
+
+CHUNK_SIZE = 500
+
+
+def get_live_totals(user_ids=None):
+    """Считает сводные количества заново по рецептам в корзинах:
+    {(user_id, ingredient_id): amount}.
+    """
+    queryset = RecipeIngredient.objects.filter(
+        recipe__shopping_cart__user__isnull=False)
+    if user_ids is not None:
+        queryset = queryset.filter(recipe__shopping_cart__user__in=user_ids)
+    return {
+        (row['recipe__shopping_cart__user'], row['ingredient']): row['total']
+        for row in queryset.values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by().iterator()}
+
+
+def change_totals(user_ids, recipe_ids, sign):
+    """Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов
+    recipe_ids из списков покупок пользователей user_ids.
+    """
+    user_ids, recipe_ids = list(user_ids), list(recipe_ids)
+    if not user_ids or not recipe_ids:
+        return
+    amounts = RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient').annotate(
+        total=Sum('amount')
+    ).order_by().values_list('ingredient', 'total')
+    apply_deltas(
+        user_ids,
+        {ingredient_id: sign * total for ingredient_id, total in amounts})
+
+
+@transaction.atomic
+def apply_deltas(user_ids, deltas):
+    """Изменяет количества ингредиентов в списках покупок
+    пользователей user_ids на deltas: {ingredient_id: изменение}.
+    Недостающие строки вставляются с нулем без ошибки на уже
+    существующих, затем все затронутые строки меняются одним
+    UPDATE amount = amount + изменение, поэтому одновременные
+    добавления в корзину не конфликтуют и не теряют изменений.
+    """
+    user_ids = list(user_ids)
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    ShoppingCartIngredient.objects.bulk_create(
+        (ShoppingCartIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, amount=0)
+         for user_id in user_ids
+         for ingredient_id, delta in deltas.items() if delta > 0),
+        batch_size=CHUNK_SIZE,
+        ignore_conflicts=True)
+    rows = ShoppingCartIngredient.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas)
+    rows.update(amount=Greatest(F('amount') + Case(
+        *(When(ingredient_id=ingredient_id, then=Value(delta))
+          for ingredient_id, delta in deltas.items()),
+        output_field=IntegerField()), 0))
+    rows.filter(amount=0).delete()
+
+
+def get_cart_user_ids(recipe):
+    """Пользователи, у которых рецепт лежит в корзине."""
+    return list(
+        recipe.shopping_cart.exclude(
+            user=None).values_list('user_id', flat=True))
+
+
+@transaction.atomic
+def rebuild_totals():
+    """Пересобирает таблицу целиком по текущему содержимому корзин."""
+    ShoppingCartIngredient.objects.all().delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        (ShoppingCartIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount)
+         for (user_id, ingredient_id), amount in get_live_totals().items()),
+        batch_size=CHUNK_SIZE)
+
+
+def verify_totals():
+    """Возвращает расхождения таблицы с живым агрегатом:
+    {(user_id, ingredient_id): (в таблице, по рецептам)}.
+    """
+    stored = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount
+        in ShoppingCartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'amount').iterator()}
+    live = get_live_totals()
+    return {
+        key: (stored.get(key), live.get(key))
+        for key in stored.keys() | live.keys()
+        if stored.get(key) != live.get(key)}
@@ -0,0 +1,122 @@
+"""Общие данные и клиенты для тестов рецептов."""
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes import catalog
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+
+User = get_user_model()
+RECIPES_URL = '/api/recipes/'
+DOWNLOAD_URL = '/api/recipes/download_shopping_cart/'
+INGREDIENTS_URL = '/api/ingredients/'
+SUBSCRIPTIONS_URL = '/api/users/subscriptions/'
+ME_URL = '/api/users/me/'
+DB_POOL_URL = '/api/metrics/db_pool/'
+MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==')
+
+
+class RecipeFixturesMixin:
+    """Фабрики пользователей, тегов, ингредиентов и рецептов.
+    Перед каждым тестом кэш очищается, каталоги перечитываются,
+    self.client аутентифицирован как cls.user, если он задан.
+    """
+
+    @classmethod
+    def create_user(cls, username='reader'):
+        return User.objects.create(
+            username=username, email=f'{username}@foodgram.ru')
+
+    @classmethod
+    def create_tags(cls, count=2):
+        return [
+            Tag.objects.create(
+                name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}')
+            for i in range(count)]
+
+    @classmethod
+    def create_ingredients(cls, count=5):
+        return [
+            Ingredient.objects.create(
+                name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(count)]
+
+    @classmethod
+    def create_recipe(cls, author, name='Рецепт', tags=(), ingredients=(),
+                      amount=2, **fields):
+        fields.setdefault('text', 'Описание')
+        fields.setdefault('cooking_time', 10)
+        recipe = Recipe.objects.create(author=author, name=name, **fields)
+        if tags:
+            recipe.tags.set(tags)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient=ingredient, amount=amount)
+            for ingredient in ingredients)
+        return recipe
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def setUp(self):
+        cache.clear()
+        catalog.bump_version()
+        catalog.bump_tag_version()
+        self.client = self.get_client(getattr(self, 'user', None))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PIPELINE_ASYNC=False)
+class MediaTestCase(RecipeFixturesMixin, TestCase):
+    """Файлы пишутся во временный MEDIA_ROOT, картинки обрабатываются
+    сразу после коммита."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('writer')
+        cls.tag = Tag.objects.create(
+            name='Тег', color='#000000', slug='tag')
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+
+    def post_recipe(self, image=IMAGE, **data):
+        if 'tags' not in data:
+            data['tags'] = [self.tag.id]
+        if 'ingredients' not in data:
+            data['ingredients'] = [{'id': self.ingredient.id, 'amount': 5}]
+        with self.run_on_commit():
+            return self.client.post(RECIPES_URL, {
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': image,
+                **data,
+            }, format='json')
+
+    @contextmanager
+    def run_on_commit(self):
+        """Выполняет колбэки после коммита, включая добавленные самими
+        колбэками: обработка картинки снимает ссылку на исходный файл.
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            yield
+        while callbacks:
+            with self.captureOnCommitCallbacks() as nested:
+                for callback in callbacks:
+                    callback()
+            callbacks = nested
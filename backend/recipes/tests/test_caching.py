@@ -0,0 +1,256 @@
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import versions
+from core.authentication import token_cache
+from recipes.models import Recipe, RecipeIngredient, Subscribe
+from .fixtures import (INGREDIENTS_URL, ME_URL, RECIPES_URL,
+                       RecipeFixturesMixin, User)
+
+
+class ConditionalGetTest(RecipeFixturesMixin, TestCase):
+    """Условные GET отвечают 304, пока таблицы не менялись."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('cook')
+        cls.tag = cls.create_tags(1)[0]
+        cls.recipe = cls.create_recipe(cls.user, 'Каша')
+
+    def assert_not_modified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertLessEqual(len(queries), 1)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_tags_and_ingredients(self):
+        etag = self.assert_not_modified('/api/tags/')
+        self.assert_not_modified(f'/api/tags/{self.tag.id}/')
+        self.assert_not_modified(INGREDIENTS_URL)
+        self.tag.color = '#FFFFFF'
+        self.tag.save()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_recipe_detail_depends_on_user_flags(self):
+        url = f'{RECIPES_URL}{self.recipe.id}/'
+        etag = self.assert_not_modified(url)
+        self.user.favorite_recipe.recipe.add(self.recipe)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertEqual(
+            self.get_client().get(
+                url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        for url in (f'{RECIPES_URL}0/', f'{RECIPES_URL}abc/',
+                    '/api/tags/abc/', f'{INGREDIENTS_URL}abc/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    @override_settings(DEBUG=False)
+    def test_process_local_cache_is_rejected_in_production(self):
+        with self.assertRaises(ImproperlyConfigured):
+            versions.check_cache_backend()
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.'
+                           'FileBasedCache',
+                'LOCATION': '/tmp/foodgram'}}):
+            versions.check_cache_backend()
+
+
+class ResponseCacheTest(RecipeFixturesMixin, TestCase):
+    """Анонимная лента отдается из кэша до изменения рецептов или тегов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.tags = cls.create_tags()
+        cls.recipe = cls.create_recipe(cls.author, tags=cls.tags)
+
+    def get(self, url, params=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'{url}{params}')
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_list_is_cached_by_normalized_params(self):
+        _, cold = self.get(RECIPES_URL, '?tags=tag0&tags=tag1')
+        self.assertGreater(cold, 0)
+        data, warm = self.get(RECIPES_URL, '?tags=tag1&tags=tag0&author=')
+        self.assertEqual(warm, 0)
+        self.assertEqual(data['count'], 1)
+        _, detail = self.get(f'{RECIPES_URL}{self.recipe.id}/')
+        self.assertEqual(
+            self.get(f'{RECIPES_URL}{self.recipe.id}/')[1], 1,
+            'из БД читается только дата публикации для Last-Modified')
+
+    def test_recipe_and_tag_changes_invalidate(self):
+        self.get(RECIPES_URL)
+        self.create_recipe(self.author, 'Новый', cooking_time=5)
+        data, queries = self.get(RECIPES_URL)
+        self.assertGreater(queries, 0)
+        self.assertEqual(data['count'], 2)
+        self.tags[0].name = 'Переименован'
+        self.tags[0].save()
+        data, _ = self.get(RECIPES_URL)
+        self.assertIn(
+            'Переименован',
+            [tag['name'] for tag in data['results'][-1]['tags']])
+
+    def test_concurrent_miss_serves_stale_entry(self):
+        self.get(RECIPES_URL)
+        self.recipe.name = 'Изменен'
+        self.recipe.save()
+        with patch('core.mixins.cache.add', return_value=False):
+            data, queries = self.get(RECIPES_URL)
+        self.assertEqual(queries, 0)
+        self.assertEqual(data['results'][0]['name'], 'Рецепт')
+        data, _ = self.get(RECIPES_URL)
+        self.assertEqual(data['results'][0]['name'], 'Изменен')
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.get(RECIPES_URL)
+        self.client.force_authenticate(self.author)
+        self.assertGreater(self.get(RECIPES_URL)[1], 0)
+
+
+class RecipeFragmentTest(RecipeFixturesMixin, TestCase):
+    """Тело рецепта кэшируется для всех пользователей, флаги
+    накладываются для каждого запроса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.author = cls.create_user('author')
+        cls.tag = cls.create_tags(1)[0]
+        cls.recipe = cls.create_recipe(
+            cls.author, tags=[cls.tag],
+            ingredients=cls.create_ingredients(1))
+
+    def get_recipe(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(RECIPES_URL)
+        self.assertEqual(response.status_code, 200)
+        tables = ' '.join(query['sql'] for query in queries)
+        return response.data['results'][0], tables
+
+    def test_body_is_cached_and_flags_are_overlaid(self):
+        recipe, tables = self.get_recipe()
+        self.assertIn('recipes_recipeingredient', tables)
+        self.assertEqual(list(recipe), [
+            'id', 'image', 'image_width', 'image_height', 'thumbnails',
+            'tags', 'author', 'ingredients', 'is_favorited',
+            'is_in_shopping_cart', 'pub_date', 'name', 'text',
+            'cooking_time', 'favorites_count', 'in_carts_count'])
+        self.assertFalse(recipe['is_favorited'])
+        Subscribe.objects.create(user=self.user, author=self.author)
+        recipe, tables = self.get_recipe()
+        self.assertNotIn('recipes_recipeingredient', tables)
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.user.favorite_recipe.recipe.add(self.recipe)
+        self.user.shopping_cart.recipe.add(self.recipe)
+        recipe, _ = self.get_recipe()
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertEqual(recipe['favorites_count'], 1)
+        self.assertEqual(recipe['in_carts_count'], 1)
+
+    def test_recipe_changes_invalidate_body(self):
+        self.get_recipe()
+        ingredient = RecipeIngredient.objects.get(recipe=self.recipe)
+        ingredient.amount = 5
+        ingredient.save()
+        recipe, tables = self.get_recipe()
+        self.assertIn('recipes_recipeingredient', tables)
+        self.assertEqual(recipe['ingredients'][0]['amount'], 5)
+        self.tag.recipes.clear()
+        recipe, _ = self.get_recipe()
+        self.assertEqual(recipe['tags'], [])
+
+    def test_image_replaced_by_another_process_invalidates_body(self):
+        self.get_recipe()
+        Recipe.objects.filter(id=self.recipe.id).update(
+            image='recipes/moved.jpg')
+        recipe, _ = self.get_recipe()
+        self.assertTrue(recipe['image'].endswith('recipes/moved.jpg'))
+
+    def test_only_author_changes_invalidate_body(self):
+        self.get_recipe()
+        self.create_user('newcomer')
+        self.author.last_login = timezone.now()
+        self.author.save(update_fields=['last_login'])
+        self.author.set_password('Secret-pass-2')
+        self.author.save()
+        _, tables = self.get_recipe()
+        self.assertNotIn('recipes_recipeingredient', tables)
+        self.author.first_name = 'Иван'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        recipe, tables = self.get_recipe()
+        self.assertIn('recipes_recipeingredient', tables)
+        self.assertEqual(recipe['author']['first_name'], 'Иван')
+
+
+class TokenCacheTest(TestCase):
+    """Повторные запросы с токеном не читают токен из БД, а выход,
+    смена пароля и блокировка сразу сбрасывают кэш.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='Secret-pass-1')
+
+    def setUp(self):
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(ME_URL)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cached_token_skips_lookup(self):
+        cold = self.count_queries()
+        self.assertEqual(self.count_queries(), cold - 1)
+
+    def test_logout_invalidates_token(self):
+        self.count_queries()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(ME_URL).status_code, 401)
+
+    def test_deactivation_invalidates_token(self):
+        self.count_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(ME_URL).status_code, 401)
+
+    def test_password_change_refreshes_user(self):
+        self.count_queries()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'Secret-pass-1',
+            'new_password': 'Another-pass-2'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.count_queries()
+        self.assertTrue(
+            token_cache.get(self.token.key).check_password('Another-pass-2'))
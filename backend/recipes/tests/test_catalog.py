@@ -0,0 +1,69 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core import versions
+from core.filters import IngredientFilter
+from recipes import catalog
+from recipes.models import Ingredient
+from .fixtures import INGREDIENTS_URL, RecipeFixturesMixin
+
+
+class IngredientSearchTest(RecipeFixturesMixin, TestCase):
+    """Поиск ингредиентов: сначала совпадения с начала названия."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('сахар', 'соль', 'морская соль', 'сахарная пудра',
+                         'фасоль', 'мука'))
+
+    def search(self, name):
+        response = self.client.get(INGREDIENTS_URL, {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_matches_first(self):
+        self.assertEqual(
+            self.search('Со'), ['соль', 'морская соль', 'фасоль'])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_results_are_capped(self):
+        self.assertEqual(self.search('са'), ['сахар', 'сахарная пудра'])
+        self.assertEqual(len(self.client.get(INGREDIENTS_URL).data), 6)
+
+    def test_catalog_reads_only_its_version(self):
+        ingredient = Ingredient.objects.get(name='соль')
+        self.search('соль')
+        with CaptureQueriesContext(connection) as queries:
+            self.search('соль')
+            response = self.client.get(f'{INGREDIENTS_URL}{ingredient.id}/')
+        self.assertEqual(response.data['name'], 'соль')
+        self.assertEqual(len(queries), 2)
+        for query in queries:
+            self.assertIn('recipes_catalogversion', query['sql'])
+        self.assertEqual(
+            self.client.get(f'{INGREDIENTS_URL}0/').status_code, 404)
+
+    def test_catalog_reloads_after_load_in_another_process(self):
+        self.search('соль')
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='соль каменная', measurement_unit='г')])
+        self.assertNotIn('соль каменная', self.search('соль'))
+        stamp = versions.get_version(catalog.TABLE)
+        catalog.bump_version()
+        self.assertEqual(versions.get_version(catalog.TABLE), stamp)
+        self.assertIn('соль каменная', self.search('соль'))
+
+    def test_catalog_reloads_after_save(self):
+        self.assertEqual(
+            self.search('соль'), ['соль', 'морская соль', 'фасоль'])
+        Ingredient.objects.create(name='соль крупная', measurement_unit='г')
+        self.assertEqual(
+            self.search('соль'),
+            ['соль', 'соль крупная', 'морская соль', 'фасоль'])
+        self.assertEqual(
+            [ingredient.name for ingredient in
+             IngredientFilter({'name': 'соль'}).qs],
+            ['соль', 'соль крупная', 'морская соль', 'фасоль'])
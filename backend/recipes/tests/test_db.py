@@ -0,0 +1,99 @@
+from http.cookies import SimpleCookie
+
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from core.db.pool import ConnectionPool, PoolTimeout
+from core.db.router import ReplicaRouter, read_from_primary
+from core.middleware import PIN_COOKIE, ReplicaMiddleware
+from recipes.models import Recipe
+from .fixtures import DB_POOL_URL, RECIPES_URL, RecipeFixturesMixin
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(RecipeFixturesMixin, TestCase):
+    """Пул переиспользует соединения и ограничивает их число."""
+
+    def test_connections_are_reused_and_limited(self):
+        pool = ConnectionPool(max_size=2, timeout=0.05)
+        first = pool.acquire(FakeConnection)
+        second = pool.acquire(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection)
+        pool.release(first)
+        self.assertIs(pool.acquire(FakeConnection), first)
+        pool.release(second, discard=True)
+        self.assertTrue(second.closed)
+        stats = pool.get_stats()
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['acquired'], 3)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['max_wait_time_ms'], 50)
+
+    def test_stats_endpoint_is_admin_only(self):
+        user = self.create_user()
+        client = self.get_client(user)
+        self.assertEqual(client.get(DB_POOL_URL).status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(client.get(DB_POOL_URL).status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TestCase):
+    """Безопасные запросы читают с реплики, пока клиент ничего
+    не изменял.
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ReplicaMiddleware(self.get_response)
+        self.cookies = SimpleCookie()
+
+    def get_response(self, request):
+        self.read_db = ReplicaRouter().db_for_read(Recipe)
+        return HttpResponse()
+
+    def route(self, method, token='first'):
+        request = getattr(self.factory, method)(RECIPES_URL)
+        if token:
+            request.META['HTTP_AUTHORIZATION'] = f'Token {token}'
+        request.COOKIES = {
+            name: morsel.value for name, morsel in self.cookies.items()}
+        self.cookies.update(self.middleware(request).cookies)
+        return self.read_db
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.assertEqual(self.route('get'), 'replica')
+        self.assertEqual(self.route('post'), 'default')
+        self.assertEqual(self.route('get'), 'default')
+        self.assertEqual(self.route('get', token='second'), 'replica')
+        self.assertEqual(ReplicaRouter().db_for_read(Recipe), 'default')
+
+    def test_read_from_primary(self):
+        def get_response(request):
+            with read_from_primary():
+                self.read_db = ReplicaRouter().db_for_read(Recipe)
+            self.after_db = ReplicaRouter().db_for_read(Recipe)
+            return HttpResponse()
+
+        self.middleware = ReplicaMiddleware(get_response)
+        self.assertEqual(self.route('get'), 'default')
+        self.assertEqual(self.after_db, 'replica')
+
+    def test_unidentified_clients_are_not_pinned(self):
+        self.assertEqual(self.route('post', token=None), 'default')
+        self.assertNotIn(PIN_COOKIE, self.cookies)
+        self.assertEqual(self.route('get', token=None), 'replica')
+
+    @override_settings(DB_REPLICA_PIN_SECONDS=0)
+    def test_pin_expires(self):
+        self.route('post')
+        self.assertEqual(self.route('get'), 'replica')
@@ -0,0 +1,196 @@
+import base64
+from io import BytesIO, StringIO
+from importlib import import_module
+from unittest.mock import patch
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+from PIL import Image
+
+from recipes import blobs, images
+from recipes.blobs import verify_refs
+from recipes.models import MediaBlob, Recipe
+from .fixtures import IMAGE, RECIPES_URL, MediaTestCase
+
+
+@override_settings(IMAGE_MAX_SIZE=400, IMAGE_THUMBNAIL_WIDTHS=[100, 200, 800])
+class RecipeImagePipelineTest(MediaTestCase):
+    """Картинка обрабатывается после коммита: размер ограничен,
+    метаданные удалены, имена файлов по хэшу содержимого.
+    """
+
+    def make_image(self):
+        image = Image.new('RGBA', (1000, 500), (255, 0, 0, 128))
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera'
+        buffer = BytesIO()
+        image.save(buffer, 'PNG', exif=exif)
+        return (
+            'data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+    def test_image_is_processed_after_commit(self):
+        response = self.post_recipe(self.make_image())
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertRegex(
+            recipe.image.name, r'^recipes/\w\w/\w\w/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(list(recipe.thumbnails), ['100', '200'])
+        with default_storage.open(recipe.image.name) as file:
+            image = Image.open(file)
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (400, 200))
+            self.assertEqual(len(image.getexif()), 0)
+        with default_storage.open(recipe.thumbnails['100']) as file:
+            self.assertEqual(Image.open(file).size, (100, 50))
+        self.assertEqual((recipe.image_width, recipe.image_height), (400, 200))
+        self.assertEqual(
+            set(MediaBlob.objects.values_list('name', flat=True)),
+            set(blobs.get_names(recipe)))
+        with patch.object(default_storage, 'url') as url:
+            data = self.client.get(f'{RECIPES_URL}{recipe.id}/').data
+        url.assert_not_called()
+        self.assertEqual(
+            data['image'], f'http://testserver/media/{recipe.image.name}')
+        self.assertEqual(
+            (data['image_width'], data['image_height']), (400, 200))
+        self.assertEqual(
+            data['thumbnails']['200'],
+            f'http://testserver/media/{recipe.thumbnails["200"]}')
+
+    def test_original_is_kept_when_processing_fails(self):
+        with patch.object(images, 'process', side_effect=OSError), \
+                self.assertLogs('recipes.images', 'ERROR'):
+            response = self.post_recipe(self.make_image())
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertRegex(recipe.image.name, r'\.png$')
+        self.assertTrue(default_storage.exists(recipe.image.name))
+        self.assertEqual(
+            (recipe.image_width, recipe.image_height), (1000, 500))
+        self.assertEqual(recipe.thumbnails, {})
+        self.assertEqual(verify_refs(), {})
+
+    def test_same_image_is_stored_once(self):
+        image = self.make_image()
+        first = Recipe.objects.get(id=self.post_recipe(image).data['id'])
+        second = Recipe.objects.get(id=self.post_recipe(image).data['id'])
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.thumbnails, second.thumbnails)
+
+    def test_invalid_image_is_rejected(self):
+        response = self.post_recipe('data:image/png;base64,bm90IGFuIGltYWdl')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+
+class ContentAddressedMediaTest(MediaTestCase):
+    """Одинаковые картинки хранятся одним файлом, файл удаляется
+    вместе с последним ссылающимся рецептом.
+    """
+
+    def create_recipe_with_image(self):
+        return Recipe.objects.get(id=self.post_recipe().data['id'])
+
+    def test_blob_is_deleted_with_last_reference(self):
+        first = self.create_recipe_with_image()
+        second = self.create_recipe_with_image()
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_blob_referenced_again_before_commit_is_kept(self):
+        name = self.create_recipe_with_image().image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            blobs.release([name])
+            blobs.acquire([name])
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 1)
+
+    def test_migration_backfills_refs(self):
+        self.create_recipe_with_image()
+        self.create_recipe_with_image()
+        MediaBlob.objects.all().delete()
+        self.assertNotEqual(verify_refs(), {})
+        import_module(
+            'recipes.migrations.0014_backfill_media_blobs'
+        ).backfill_media_blobs(apps, None)
+        self.assertEqual(verify_refs(), {})
+
+    def test_dedupe_command_merges_legacy_files(self):
+        content = base64.b64decode(IMAGE.split(',')[1])
+        legacy = [
+            default_storage.save(f'static/recipe/{name}.png',
+                                 BytesIO(content))
+            for name in ('first', 'second')]
+        recipes = [
+            self.create_recipe_with_image(), self.create_recipe_with_image()]
+        MediaBlob.objects.all().delete()
+        for recipe, name in zip(recipes, legacy):
+            Recipe.objects.filter(id=recipe.id).update(image=name)
+        with self.assertRaises(CommandError):
+            call_command('dedupe_media', verify_only=True, stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=StringIO())
+        names = {
+            recipe.image.name
+            for recipe in Recipe.objects.filter(id__in=[
+                recipe.id for recipe in recipes])}
+        self.assertEqual(len(names), 1)
+        self.assertTrue(default_storage.exists(names.pop()))
+        for name in legacy:
+            self.assertFalse(default_storage.exists(name))
+        self.assertEqual(verify_refs(), {})
+
+
+class RecipeAdminImageTest(MediaTestCase):
+    """Картинка из админки проходит ту же обработку, что и из API."""
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def post_admin(self, url, **data):
+        with self.run_on_commit():
+            return self.client.post(url, {
+                'author': self.user.id,
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'tags': [self.tag.id],
+                'cooking_time': 10,
+                'recipe-TOTAL_FORMS': 1,
+                'recipe-INITIAL_FORMS': 0,
+                'recipe-0-ingredient': self.ingredient.id,
+                'recipe-0-amount': 5,
+                **data,
+            })
+
+    def test_upload_is_processed(self):
+        content = base64.b64decode(IMAGE.split(',')[1])
+        upload = SimpleUploadedFile('image.png', content)
+        response = self.post_admin(
+            '/admin/recipes/recipe/add/', upload=upload)
+        self.assertEqual(response.status_code, 302)
+        recipe = Recipe.objects.get()
+        self.assertRegex(
+            recipe.image.name, r'^recipes/\w\w/\w\w/[0-9a-f]{64}\.jpg$')
+        self.assertIsNotNone(recipe.image_width)
+        self.assertEqual(verify_refs(), {})
+        response = self.post_admin(
+            f'/admin/recipes/recipe/{recipe.id}/change/',
+            upload=SimpleUploadedFile('image.png', b'not an image'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('upload', response.context['adminform'].form.errors)
@@ -0,0 +1,193 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from recipes.benchmark import (check_budgets, load_budgets, load_dataset,
+                               run_benchmark)
+from recipes.models import Recipe, Subscribe, Tag
+from recipes.plans import check_filter_plans, explain
+from .fixtures import RECIPES_URL, SUBSCRIPTIONS_URL, RecipeFixturesMixin
+
+
+class RecipeListQueriesTest(RecipeFixturesMixin, TestCase):
+    """Количество запросов к БД не зависит от числа рецептов на странице."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.authors = [cls.create_user(f'author{i}') for i in range(3)]
+        Subscribe.objects.create(user=cls.user, author=cls.authors[0])
+        cls.tags = cls.create_tags()
+        cls.ingredients = cls.create_ingredients()
+
+    def create_recipes(self, count):
+        for index in range(count):
+            self.create_recipe(
+                self.authors[index % len(self.authors)], f'Рецепт {index}',
+                self.tags, self.ingredients)
+
+    def count_queries(self, client, limit):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(RECIPES_URL, {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(queries)
+
+    def assert_constant_queries(self, client):
+        self.create_recipes(2)
+        small_page = self.count_queries(client, 2)
+        self.create_recipes(18)
+        self.assertEqual(self.count_queries(client, 20), small_page)
+
+    def test_anonymous_list_queries(self):
+        self.assert_constant_queries(self.get_client())
+
+    def test_authenticated_list_queries(self):
+        self.assert_constant_queries(self.client)
+
+    def test_cursor_pagination(self):
+        self.create_recipes(7)
+        client = self.get_client()
+        response = client.get(
+            RECIPES_URL, {'cursor': '', 'limit': 3, 'with_count': 1})
+        self.assertEqual(response.data['count'], 7)
+        self.assertIsNone(response.data['previous'])
+        names = [recipe['name'] for recipe in response.data['results']]
+        while response.data['next']:
+            response = client.get(response.data['next'])
+            self.assertNotIn('count', response.data)
+            names += [recipe['name'] for recipe in response.data['results']]
+        self.assertEqual(
+            names, [f'Рецепт {index}' for index in range(6, -1, -1)])
+        response = client.get(RECIPES_URL, {'page': 2, 'limit': 3})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 3)
+        for ordering, status_code in (('-pub_date', 200),
+                                      ('-favorites_count', 400)):
+            response = client.get(
+                RECIPES_URL, {'cursor': '', 'ordering': ordering})
+            self.assertEqual(response.status_code, status_code)
+
+    def test_author_subscription_flag(self):
+        self.create_recipes(3)
+        response = self.client.get(RECIPES_URL)
+        flags = {
+            recipe['author']['id']: recipe['author']['is_subscribed']
+            for recipe in response.data['results']}
+        self.assertEqual(flags, {
+            self.authors[0].id: True,
+            self.authors[1].id: False,
+            self.authors[2].id: False})
+
+
+class SubscriptionsQueriesTest(RecipeFixturesMixin, TestCase):
+    """Страница подписок читается фиксированным числом запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        for index in range(4):
+            author = cls.create_user(f'author{index}')
+            Subscribe.objects.create(user=cls.user, author=author)
+            for number in range(index + 1):
+                cls.create_recipe(author, f'Рецепт {index}.{number}')
+
+    def get_subscriptions(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(SUBSCRIPTIONS_URL, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_queries_do_not_depend_on_page_size(self):
+        _, small_page = self.get_subscriptions(
+            {'limit': 1, 'recipes_limit': 2})
+        _, full_page = self.get_subscriptions(
+            {'limit': 4, 'recipes_limit': 2})
+        self.assertEqual(full_page, small_page)
+
+    def test_recipes_limit_and_count(self):
+        results, _ = self.get_subscriptions({'recipes_limit': 2})
+        for author in results:
+            index = int(author['username'][len('author'):])
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], index + 1)
+            self.assertEqual(
+                [recipe['name'] for recipe in author['recipes']],
+                [f'Рецепт {index}.{number}'
+                 for number in range(index, -1, -1)][:2])
+
+    @override_settings(
+        SUBSCRIPTION_RECIPES_LIMIT=1, SUBSCRIPTION_RECIPES_MAX_LIMIT=3)
+    def test_recipes_limit_is_capped(self):
+        for params, expected in (({}, 1), ({'recipes_limit': 'x'}, 1),
+                                 ({'recipes_limit': 10}, 3)):
+            results, _ = self.get_subscriptions(params)
+            self.assertEqual(
+                max(len(author['recipes']) for author in results), expected)
+
+
+class BenchmarkBudgetTest(TestCase):
+    """Число запросов сценариев нагрузочного стенда с прогретыми
+    и очищенными кэшами укладывается в бюджет. Задержка и память
+    проверяются командой benchmark на полном объеме.
+    """
+
+    def test_query_budgets(self):
+        reader = load_dataset(
+            users=30, recipes=120, subscriptions=12, cart_size=10)
+        results = run_benchmark(reader, repeat=1)
+        errors = check_budgets(
+            results, load_budgets(), metrics=('queries', 'cold_queries'))
+        self.assertEqual(errors, [])
+
+
+class RecipeFilterIndexTest(RecipeFixturesMixin, TestCase):
+    """Каждая комбинация фильтров списка рецептов идет по индексам,
+    варианты тегов берутся из каталога без запроса к БД."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.tags = cls.create_tags()
+        cls.recipes = [
+            cls.create_recipe(cls.user, f'Рецепт {i}') for i in range(3)]
+        cls.recipes[0].tags.set(cls.tags)
+        cls.recipes[1].tags.set(cls.tags[1:])
+        cls.user.favorite_recipe.recipe.add(*cls.recipes[:2])
+        cls.user.shopping_cart.recipe.add(cls.recipes[1])
+
+    def test_filter_combinations_use_indexes(self):
+        results = check_filter_plans(
+            self.user, self.user.id, [tag.slug for tag in self.tags])
+        self.assertEqual(len(results), 16)
+        for combination, (lines, problems) in results.items():
+            self.assertEqual(problems, [], (combination, lines))
+        _, problems = explain(
+            Recipe.objects.filter(text='Описание').order_by())
+        self.assertNotEqual(problems, [])
+        call_command('check_recipe_filter_plans', stdout=StringIO())
+
+    def test_tags_filter_reads_slugs_from_catalog(self):
+        self.client.get(RECIPES_URL, {'tags': 'tag0'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                RECIPES_URL, {'tags': ['tag0', 'tag1'], 'is_favorited': 1})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.recipes[1].id, self.recipes[0].id])
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('DISTINCT', sql)
+        response = self.client.get(
+            RECIPES_URL, {'tags': 'tag1', 'is_in_shopping_cart': 0})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.recipes[0].id])
+        self.assertEqual(
+            self.client.get(RECIPES_URL, {'tags': 'missing'}).status_code,
+            400)
+        Tag.objects.create(name='Новый', color='#111111', slug='new')
+        self.assertEqual(
+            self.client.get(RECIPES_URL, {'tags': 'new'}).status_code, 200)
@@ -0,0 +1,151 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from api.serializers import RecipeWriteSerializer
+from recipes import shopping_totals
+from recipes.counters import verify_counters
+from recipes.models import Recipe, RecipeIngredient
+from .fixtures import RECIPES_URL, MediaTestCase, RecipeFixturesMixin
+
+
+class RecipeWriteValidationTest(MediaTestCase):
+    """Проверка ингредиентов и тегов при создании рецепта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('writer')
+        cls.tags = cls.create_tags()
+        cls.ingredients = cls.create_ingredients(30)
+
+    def post(self, ingredient_ids, tag_ids):
+        return self.post_recipe(
+            tags=tag_ids,
+            ingredients=[{'id': pk, 'amount': 5} for pk in ingredient_ids])
+
+    def test_validation_queries_do_not_grow(self):
+        ids = [ingredient.id for ingredient in self.ingredients]
+        tag_ids = [tag.id for tag in self.tags]
+        self.post(ids[:1], tag_ids[:1])
+        with CaptureQueriesContext(connection) as small:
+            self.post(ids[:1], tag_ids[:1])
+        with CaptureQueriesContext(connection) as large:
+            response = self.post(ids, tag_ids)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(large), len(small))
+
+    def test_errors_point_at_ingredient_ids(self):
+        first, second = self.ingredients[0].id, self.ingredients[1].id
+        response = self.post([first, second, first], [self.tags[0].id])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'id=[{first}]', str(response.data))
+        response = self.post([first, 0], [self.tags[0].id])
+        self.assertIn('id=[0]', str(response.data))
+        response = self.post([first], [self.tags[0].id, 0])
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_touches_only_changed_ingredients(self):
+        first, second, third = self.ingredients[:3]
+        response = self.post([first.id, second.id], [self.tags[0].id])
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.user.shopping_cart.recipe.add(recipe)
+        unchanged = RecipeIngredient.objects.get(
+            recipe=recipe, ingredient=first)
+        response = self.client.patch(f'{RECIPES_URL}{recipe.id}/', {
+            'tags': [self.tags[1].id],
+            'ingredients': [
+                {'id': first.id, 'amount': 5},
+                {'id': third.id, 'amount': 8}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            RecipeIngredient.objects.get(
+                recipe=recipe, ingredient=first).id,
+            unchanged.id)
+        self.assertEqual(
+            dict(recipe.recipe.values_list('ingredient', 'amount')),
+            {first.id: 5, third.id: 8})
+        self.assertEqual(
+            list(recipe.tags.values_list('id', flat=True)),
+            [self.tags[1].id])
+        self.assertEqual(shopping_totals.verify_totals(), {})
+
+    def test_update_saves_only_changed_fields(self):
+        response = self.post(
+            [self.ingredients[0].id], [self.tags[0].id])
+        recipe = Recipe.objects.get(id=response.data['id'])
+        Recipe.objects.filter(id=recipe.id).update(
+            favorites_count=4, thumbnails={'100': 'recipes/thumb.jpg'})
+        serializer = RecipeWriteSerializer(
+            recipe, data={'name': 'Новое название'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 4)
+        self.assertEqual(recipe.thumbnails, {'100': 'recipes/thumb.jpg'})
+
+
+class RecipeCountersTest(RecipeFixturesMixin, TestCase):
+    """Счетчики избранного и корзин следуют за связями."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [cls.create_user(f'user{i}') for i in range(3)]
+        cls.recipes = [
+            cls.create_recipe(cls.users[0], f'Рецепт {i}') for i in range(3)]
+
+    def counts(self, field):
+        return list(Recipe.objects.order_by('id').values_list(
+            field, flat=True))
+
+    def test_counters_follow_links(self):
+        first, second, third = self.recipes
+        for user in self.users:
+            user.favorite_recipe.recipe.add(first, second)
+        self.users[0].favorite_recipe.recipe.add(first)
+        self.users[0].favorite_recipe.recipe.remove(second, third)
+        self.assertEqual(self.counts('favorites_count'), [3, 2, 0])
+        third.favorite_recipe.add(*(
+            user.favorite_recipe for user in self.users))
+        third.favorite_recipe.remove(self.users[1].favorite_recipe)
+        self.users[2].favorite_recipe.recipe.clear()
+        self.assertEqual(self.counts('favorites_count'), [2, 1, 1])
+        self.users[0].shopping_cart.recipe.add(first)
+        self.users[1].shopping_cart.recipe.add(first, third)
+        first.shopping_cart.clear()
+        self.users[1].delete()
+        self.assertEqual(self.counts('in_carts_count'), [0, 0, 0])
+        self.assertEqual(self.counts('favorites_count'), [1, 0, 1])
+        self.assertEqual(verify_counters(), {})
+
+    def test_counters_are_shown_in_recipe(self):
+        url = f'{RECIPES_URL}{self.recipes[0].id}/'
+        self.assertEqual(self.client.get(url).data['favorites_count'], 0)
+        self.users[1].favorite_recipe.recipe.add(self.recipes[0])
+        self.users[2].shopping_cart.recipe.add(self.recipes[0])
+        response = self.client.get(url)
+        self.assertEqual(response.data['favorites_count'], 1)
+        self.assertEqual(response.data['in_carts_count'], 1)
+
+    def test_reconcile_command_and_popular_ordering(self):
+        first, second, third = self.recipes
+        self.users[0].favorite_recipe.recipe.add(second, third)
+        self.users[1].favorite_recipe.recipe.add(second)
+        Recipe.objects.update(favorites_count=0)
+        anonymous = self.get_client()
+        anonymous.get(RECIPES_URL, {'ordering': '-favorites_count'})
+        with self.assertRaises(CommandError):
+            call_command(
+                'reconcile_recipe_counters', verify_only=True,
+                stdout=StringIO())
+        call_command('reconcile_recipe_counters', stdout=StringIO())
+        for client in (self.client, anonymous):
+            response = client.get(
+                RECIPES_URL, {'ordering': '-favorites_count'})
+            self.assertEqual(
+                [recipe['id'] for recipe in response.data['results']],
+                [second.id, third.id, first.id])
@@ -0,0 +1,76 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from recipes import search
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from .fixtures import RECIPES_URL, RecipeFixturesMixin
+
+
+class RecipeSearchTest(RecipeFixturesMixin, TestCase):
+    """Полнотекстовый поиск по названию, описанию и ингредиентам
+    с сортировкой по релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = cls.create_user('author')
+        cls.beet = Ingredient.objects.create(
+            name='Свекла', measurement_unit='г')
+        cabbage = Ingredient.objects.create(
+            name='Капуста', measurement_unit='г')
+        cls.borscht = cls.create_recipe(
+            author, 'Борщ украинский', ingredients=[cls.beet], amount=300,
+            text='Наваристый суп', cooking_time=90)
+        cls.soup = cls.create_recipe(
+            author, 'Щи', ingredients=[cabbage], amount=500,
+            text='Суп без борщевой заправки', cooking_time=60)
+        cls.salad = cls.create_recipe(
+            author, 'Салат', ingredients=[cabbage], amount=200,
+            text='Легкий салат')
+        search.update_search_index(Recipe.objects.values('id'))
+
+    def search(self, value):
+        response = self.client.get(RECIPES_URL, {'search': value})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_results_are_ranked(self):
+        self.assertEqual(
+            self.search('борщ'), [self.borscht.id, self.soup.id])
+        self.assertEqual(self.search('суп наваристый'), [self.borscht.id])
+        self.assertEqual(
+            self.search('капуста'), [self.salad.id, self.soup.id])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_index_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.beet.name = 'Буряк'
+            self.beet.save()
+        self.assertEqual(self.search('буряк'), [self.borscht.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.salad.name = 'Борщ зеленый'
+            self.salad.save()
+        self.assertEqual(self.search('зеленый борщ'), [self.salad.id])
+        self.salad.delete()
+        self.assertEqual(
+            self.search('борщ'), [self.borscht.id, self.soup.id])
+
+    def test_recipe_is_reindexed_once_per_transaction(self):
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Укроп', 'Петрушка', 'Сметана')]
+        with patch.object(
+                search, 'update_search_index',
+                wraps=search.update_search_index) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                for ingredient in ingredients:
+                    RecipeIngredient.objects.create(
+                        recipe=self.salad, ingredient=ingredient, amount=10)
+        update.assert_called_once_with([self.salad.id])
+        self.assertEqual(self.search('укроп сметана'), [self.salad.id])
+
+    def test_ranked_search_rejects_cursor(self):
+        response = self.client.get(
+            RECIPES_URL, {'search': 'борщ', 'cursor': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
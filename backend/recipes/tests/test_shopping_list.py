@@ -0,0 +1,148 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from api import shopping_list
+from recipes import shopping_totals
+from recipes.models import (Ingredient, RecipeIngredient,
+                            ShoppingCartIngredient, Tag)
+from .fixtures import DOWNLOAD_URL, RECIPES_URL, RecipeFixturesMixin
+
+
+class ShoppingCartDownloadTest(RecipeFixturesMixin, TestCase):
+    """Список покупок суммирует ингредиенты и кэширует готовый PDF."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('buyer')
+        flour, milk = (
+            Ingredient.objects.create(name='мука', measurement_unit='г'),
+            Ingredient.objects.create(name='молоко', measurement_unit='мл'))
+        cls.recipes = []
+        for index, amounts in enumerate(((100, 200), (50, 10))):
+            recipe = cls.create_recipe(cls.user, f'Рецепт {index}')
+            RecipeIngredient.objects.bulk_create((
+                RecipeIngredient(
+                    recipe=recipe, ingredient=flour, amount=amounts[0]),
+                RecipeIngredient(
+                    recipe=recipe, ingredient=milk, amount=amounts[1])))
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.user.shopping_cart.recipe.add(*self.recipes)
+
+    def test_shopping_list_sums_amounts(self):
+        self.assertEqual(
+            [(item['name'], item['amount'])
+             for item in shopping_list.get_shopping_list(self.user)],
+            [('молоко', 210), ('мука', 150)])
+
+    def test_pdf_is_cached_until_cart_changes(self):
+        response = self.client.get(DOWNLOAD_URL)
+        self.assertEqual(response.status_code, 200)
+        key = shopping_list.CACHE_KEY.format(user_id=self.user.id)
+        self.assertIsNotNone(cache.get(key))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(DOWNLOAD_URL)
+        self.assertEqual(len(queries), 1)
+        self.user.shopping_cart.recipe.remove(self.recipes[0])
+        self.assertIsNone(cache.get(key))
+
+    def test_totals_follow_cart_and_recipe_changes(self):
+        cart = self.user.shopping_cart
+        cart.recipe.remove(self.recipes[0])
+        cart.recipe.remove(self.recipes[0])
+        self.assertEqual(shopping_totals.verify_totals(), {})
+        tag = Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        response = self.client.patch(
+            f'{RECIPES_URL}{self.recipes[1].id}/',
+            {'tags': [tag.id],
+             'ingredients': [{'id': self.recipes[1].ingredients.first().id,
+                              'amount': 7}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(shopping_totals.verify_totals(), {})
+        self.recipes[0].shopping_cart.add(cart)
+        self.assertEqual(shopping_totals.verify_totals(), {})
+        self.recipes[0].delete()
+        self.assertEqual(shopping_totals.verify_totals(), {})
+        cart.recipe.clear()
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+
+    def test_deltas_add_to_rows_inserted_concurrently(self):
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        ShoppingCartIngredient.objects.create(
+            user=self.user, ingredient=salt, amount=3)
+        shopping_totals.apply_deltas([self.user.id], {salt.id: 2})
+        self.assertEqual(
+            ShoppingCartIngredient.objects.get(ingredient=salt).amount, 5)
+        shopping_totals.apply_deltas([self.user.id], {salt.id: -7})
+        self.assertFalse(
+            ShoppingCartIngredient.objects.filter(ingredient=salt).exists())
+
+    def test_rebuild_command_repairs_totals(self):
+        ShoppingCartIngredient.objects.update(amount=1)
+        with self.assertRaises(CommandError):
+            call_command(
+                'rebuild_shopping_lists', verify_only=True, stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(shopping_totals.verify_totals(), {})
+
+    @override_settings(SHOPPING_CART_ASYNC_ROWS=1)
+    def test_large_cart_renders_in_background(self):
+        items = shopping_list.get_shopping_list(self.user)
+        digest = shopping_list.get_digest(items)
+        pending_key = shopping_list.PENDING_KEY.format(
+            user_id=self.user.id, digest=digest)
+        cache.set(pending_key, True)
+        self.assertIsNone(shopping_list.render_in_background(
+            self.user.id, digest, items))
+        cache.delete(pending_key)
+        with patch.object(
+                shopping_list, 'render_pdf', side_effect=OSError):
+            future = shopping_list.render_in_background(
+                self.user.id, digest, items)
+            self.assertIsInstance(future.exception(), OSError)
+        self.assertIsNone(cache.get(pending_key))
+        shopping_list.render_in_background(
+            self.user.id, digest, items).result()
+        response = self.client.get(DOWNLOAD_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    @override_settings(SHOPPING_CART_ASYNC_ROWS=1)
+    def test_large_cart_returns_accepted_only_on_request(self):
+        with patch.object(shopping_list, 'render_in_background') as render:
+            response = self.client.get(DOWNLOAD_URL)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            render.assert_not_called()
+            cache.clear()
+            for params, headers in (
+                    ({'async': '1'}, {}),
+                    ({}, {'HTTP_PREFER': 'respond-async, wait=5'})):
+                response = self.client.get(DOWNLOAD_URL, params, **headers)
+                self.assertEqual(response.status_code, 202)
+                self.assertIn('Retry-After', response)
+
+    def test_streaming_formats(self):
+        response = self.client.get(DOWNLOAD_URL, {'format': 'txt'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'Cписок покупок:\n1. молоко - 210 мл.\n2. мука - 150 г.\n')
+        response = self.client.get(DOWNLOAD_URL, {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['Название,Единицы измерения,Количество',
+             'молоко,мл,210', 'мука,г,150'])
+        response = self.client.get(DOWNLOAD_URL, {'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')